@@ -0,0 +1,292 @@
+# Store games as packed positions and encoded moves in one binary file, which is read by memory-mapping it.
+#
+# Any game or position in the archive can be reached at once, without parsing the file or reading the rest of it, and
+# the data is used in place: positions are returned as memoryviews of the mapped file. All the positions together can
+# be handed to batch.py as one array (see batch.get_packed_array), so the games in an archive can be scored without
+# creating a single Board.
+#
+# File layout (little-endian):
+#     header -- HEADER_SIZE bytes: see HEADER_FORMAT
+#     positions -- every position of every game, PACKED_SIZE bytes each (see Board.pack), stored end to end. Each game
+#                  has one more position than moves: its starting position, then the position after each move.
+#     moves -- every move of every game, 2 bytes each (see Move.encode)
+#     game index -- for each game, the number of moves in the archive before it (8 bytes each), plus the total number of
+#                   moves at the end. Game n has moves index[n] to index[n + 1], and positions index[n] + n to
+#                   index[n + 1] + n.
+#     results -- 1 byte for each game: index of the result in pgn.RESULTS
+# The moves and the game index start on a multiple of 8 bytes.
+#
+# Size: 70 bytes per position plus 2 per move, so an 80 move game takes about 5.8 KB. Reading a position is a slice of
+# the mapped file, rather than parsing a FEN string or replaying the game's moves.
+#
+# Usage:
+#     python archive.py games.pgn --output games.arc     Check and store every game from a PGN file.
+#     python archive.py games.arc                        Print the number of games, moves and positions.
+#     python archive.py games.arc --game 12              Print the moves and final position of game 12 (from 0).
+#     python archive.py games.arc --position 1000        Print position 1000 (from 0) in FEN.
+#     python batch.py games.arc --archive                Evaluate every position in the archive.
+
+import argparse
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+import mmap
+import struct
+import sys
+import time
+
+from board import Board, Move, PACKED_SIZE
+import pgn
+
+
+MAGIC = b'CHESSARC'
+VERSION = 1
+
+# magic, version, position size, number of games, positions and moves, and the offsets of the moves, game index and
+# results
+HEADER_FORMAT = '<8sHHQQQQQQ'
+HEADER_SIZE = 64
+
+# Game in an archive, read without copying:
+#     number -- index of the game in the archive, from 0
+#     positions -- memoryview of the game's packed positions, PACKED_SIZE bytes each
+#     moves -- memoryview of the game's encoded moves, one 16 bit integer each
+#     result -- one of pgn.RESULTS
+ArchivedGame = namedtuple('ArchivedGame', ['number', 'positions', 'moves', 'result'])
+
+
+def get_padding(offset):
+    # Number of bytes to add after offset to reach a multiple of 8
+    return -offset % 8
+
+
+class ArchiveWriter:
+    # Write games to a new archive. Positions are written to the file as each game is added. Only the moves and the
+    # game index (2 bytes per move and 9 per game) are kept in memory until the archive is closed.
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(bytes(HEADER_SIZE))  # Written by close, once the sizes are known
+        self.moves = array('H')
+        self.game_index = array('Q', [0])
+        self.results = bytearray()
+        self.position_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def game_count(self):
+        return len(self.results)
+
+    def add_game(self, moves, start=None, result='*', positions=None):
+        # moves -- legal board.Moves, in the order played
+        # start -- Board holding the starting position (default: the normal starting position). It is not changed.
+        # result -- one of pgn.RESULTS
+        # positions -- packed positions of the game (see Board.pack), if already known: the starting position, then the
+        #              position after each move. Otherwise the moves are played from start to find them.
+        if positions is None:
+            board = Board(packed=start.pack()) if start is not None else Board()
+            positions = [board.pack()]
+            for move in moves:
+                board.make_move(move)
+                positions.append(board.pack())
+        elif len(positions) != len(moves) + 1:
+            raise ValueError("A game needs one more position than moves")
+        self.moves.extend(move.encode() for move in moves)
+        self.file.write(b''.join(positions))
+        self.position_count += len(positions)
+        self.game_index.append(len(self.moves))
+        self.results.append(pgn.RESULTS.index(result))
+
+    def close(self):
+        if self.file.closed:
+            return
+        if sys.byteorder != 'little':
+            self.moves.byteswap()
+            self.game_index.byteswap()
+        moves_offset = HEADER_SIZE + self.position_count * PACKED_SIZE
+        moves_offset += get_padding(moves_offset)
+        index_offset = moves_offset + 2 * len(self.moves)
+        index_offset += get_padding(index_offset)
+        results_offset = index_offset + 8 * len(self.game_index)
+
+        self.file.write(bytes(get_padding(self.file.tell())))
+        self.file.write(self.moves.tobytes())
+        self.file.write(bytes(get_padding(self.file.tell())))
+        self.file.write(self.game_index.tobytes())
+        self.file.write(self.results)
+        self.file.seek(0)
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, PACKED_SIZE, self.game_count, self.position_count,
+                                    len(self.moves), moves_offset, index_offset, results_offset))
+        self.file.close()
+
+
+class Archive:
+    # Read an archive made by ArchiveWriter, without loading it into memory. The operating system reads the parts of
+    # the file which are used, and can share them between processes reading the same archive.
+    # Memoryviews returned by the archive (and NumPy arrays made from them) stay valid after it is closed: the file is
+    # unmapped once the last of them is gone.
+    def __init__(self, path):
+        with open(path, 'rb') as archive_file:
+            self.map = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.read_header()
+        except (ValueError, struct.error):
+            self.map.close()
+            raise
+
+    def read_header(self):
+        if len(self.map) < HEADER_SIZE:
+            raise ValueError("Not an archive: file is too short")
+        (magic, version, position_size, self.game_count, self.position_count, move_count, moves_offset, index_offset,
+         results_offset) = struct.unpack_from(HEADER_FORMAT, self.map)
+        if magic != MAGIC:
+            raise ValueError("Not an archive")
+        if version != VERSION or position_size != PACKED_SIZE:
+            raise ValueError("Unsupported archive version %d (position size %d)" % (version, position_size))
+        if results_offset + self.game_count > len(self.map):
+            raise ValueError("Archive is truncated")
+        if sys.byteorder != 'little':
+            raise ValueError("Archives can only be read on little-endian machines")
+
+        data = memoryview(self.map)
+        self.positions = data[HEADER_SIZE:HEADER_SIZE + self.position_count * PACKED_SIZE]
+        self.moves = data[moves_offset:moves_offset + 2 * move_count].cast('H')
+        self.game_index = data[index_offset:index_offset + 8 * (self.game_count + 1)].cast('Q')
+        self.results = data[results_offset:results_offset + self.game_count]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.game_count
+
+    def __iter__(self):
+        for number in range(self.game_count):
+            yield self.get_game(number)
+
+    @property
+    def move_count(self):
+        return len(self.moves)
+
+    def get_game(self, number):
+        # ArchivedGame for game number (from 0)
+        if not 0 <= number < self.game_count:
+            raise IndexError("No game %d in the archive" % number)
+        first_move, end_move = self.game_index[number], self.game_index[number + 1]
+        first_position = first_move + number
+        positions = self.positions[first_position * PACKED_SIZE:(end_move + number + 1) * PACKED_SIZE]
+        return ArchivedGame(number, positions, self.moves[first_move:end_move], pgn.RESULTS[self.results[number]])
+
+    def get_moves(self, number):
+        # board.Moves of game number (from 0)
+        return [Move.decode(code) for code in self.get_game(number).moves]
+
+    def get_position(self, index):
+        # Packed position number index (from 0) of the whole archive, as a memoryview of PACKED_SIZE bytes
+        if not 0 <= index < self.position_count:
+            raise IndexError("No position %d in the archive" % index)
+        return self.positions[index * PACKED_SIZE:(index + 1) * PACKED_SIZE]
+
+    def get_board(self, index):
+        # Board for position number index. It has no move history, so repetitions before it aren't known.
+        return Board(packed=self.get_position(index))
+
+    def find_game(self, index):
+        # (game number, ply) of position number index: the game it belongs to, and the number of moves played in that
+        # game before it.
+        if not 0 <= index < self.position_count:
+            raise IndexError("No position %d in the archive" % index)
+        number = bisect_right(range(self.game_count), index, key=lambda n: self.game_index[n] + n) - 1
+        return number, index - self.game_index[number] - number
+
+    def close(self):
+        for view in (self.positions, self.moves, self.game_index, self.results):
+            view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # Views of the file are still in use
+        self.map = None
+
+
+def convert_pgn(pgn_file, path):
+    # Check each game from a PGN file, and store the games without illegal moves in a new archive.
+    # Returns (games stored, games skipped).
+    skipped = 0
+    start = time.perf_counter()
+    with ArchiveWriter(path) as writer:
+        for game in pgn.read_games(pgn_file):
+            # The positions are packed while the moves are checked, so the game is only played once.
+            try:
+                board = Board.from_fen(game.tags['FEN']) if 'FEN' in game.tags else Board()
+                moves = []
+                positions = [board.pack()]
+                for san in game.moves:
+                    moves.append(board.parse_san(san))
+                    board.make_move(moves[-1])
+                    positions.append(board.pack())
+            except Exception as e:
+                # Any failure is caused by the game's moves or tags. The game is left out, and the others go on.
+                print("Game %d skipped: %s" % (game.number, e), file=sys.stderr)
+                skipped += 1
+                continue
+            result = game.tags.get('Result', '*')
+            writer.add_game(moves, result=result if result in pgn.RESULTS else '*', positions=positions)
+            if writer.game_count % 1000 == 0:
+                seconds = time.perf_counter() - start
+                print("%d games, %.0f games/s" % (writer.game_count, writer.game_count / seconds), file=sys.stderr)
+        return writer.game_count, skipped
+
+
+def print_game(archive, number):
+    game = archive.get_game(number)
+    print("Result: " + game.result)
+    print(' '.join(str(Move.decode(code)) for code in game.moves))
+    print(Board(packed=game.positions[-PACKED_SIZE:]).to_fen())
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Store games in a binary archive, or read games and positions from "
+                                                 "one.")
+    parser.add_argument('file', help="archive to read, or PGN file to convert with --output (- for standard input)")
+    parser.add_argument('--output', help="archive to write the games of a PGN file to")
+    parser.add_argument('--game', type=int, help="print the moves and final position of a game (from 0)")
+    parser.add_argument('--position', type=int, help="print a position (from 0) in FEN")
+    args = parser.parse_args(args)
+
+    if args.output:
+        pgn_file = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8', errors='replace')
+        start = time.perf_counter()
+        try:
+            games, skipped = convert_pgn(pgn_file, args.output)
+        finally:
+            if pgn_file is not sys.stdin:
+                pgn_file.close()
+        print("%d games stored, %d skipped in %.2fs" % (games, skipped, time.perf_counter() - start), file=sys.stderr)
+        return 1 if skipped else 0
+
+    try:
+        with Archive(args.file) as archive:
+            if args.game is not None:
+                print_game(archive, args.game)
+            elif args.position is not None:
+                number, ply = archive.find_game(args.position)
+                print("Game %d, after %d moves" % (number, ply))
+                print(archive.get_board(args.position).to_fen())
+            else:
+                print("%d games, %d moves, %d positions" % (len(archive), archive.move_count, archive.position_count))
+    except (OSError, ValueError, IndexError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
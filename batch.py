@@ -0,0 +1,401 @@
+# Evaluate many positions at once with NumPy, for scoring large numbers of positions from game archives.
+#
+# A batch of N positions is an (N, 64) int8 array holding the piece on each square (y * 8 + x), using the same codes as
+# Board.pack: 0 => empty, 1 - 6 => white Pawn, Knight, Bishop, Rook, Queen, King, 7 - 12 => black pieces in the same
+# order. Packed positions stored end to end (see Board.pack) can be read into a batch without creating any Board.
+#
+# Each feature is worked out for the whole batch with array operations, rather than one piece at a time:
+#     score -- material plus piece-square tables, as evaluation.evaluate
+#     mobility -- number of squares each side attacks, as Board.get_mobility
+#     king attacks -- number of attacks by the opponent on each King's square and the squares around it
+#     pawn shield -- number of a side's pawns on the three squares in front of its King
+#     in check -- whether each King is attacked
+#
+# Pseudo-legal moves (moves which may leave the King in check) are counted for the whole batch with bitboards: one
+# uint64 per position for each piece code, with bit y * 8 + x set for each square, as in bitboard.py. Attacks are
+# found by shifting and masking the bitboards of every position together. Lines of ranged pieces are filled with
+# Kogge-Stone shifts (by 1, 2 and 4 squares), so all the Rooks, Bishops and Queens of a side are followed at once.
+#
+# Usage:
+#     python batch.py positions.fen           Print the features for each FEN in the file (one per line).
+#     python batch.py positions.bin --packed  Read packed positions stored end to end instead.
+#     python batch.py games.arc --archive     Read every position of the games in an archive (see archive.py).
+#     python batch.py positions.fen --moves   Print pseudo-legal move counts for each position instead.
+#
+# Requires NumPy.
+
+import argparse
+from collections import namedtuple
+import sys
+import time
+
+import numpy as np
+
+import archive
+from board import Board, PACKED_PIECES, PACKED_SIZE, WHITE_KING_SIDE, WHITE_QUEEN_SIDE
+import evaluation
+import pieces
+
+
+# Code for each piece in a batch, for white. Black pieces are 6 more.
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(1, 7)
+
+# Score of each piece code on each square, for white. Black's scores are negative. (13, 64)
+SQUARE_SCORES = np.zeros((13, 64), np.int32)
+# Material value of each piece code, for white. (13,)
+MATERIAL_VALUES = np.zeros(13, np.int32)
+for _code, _piece_class in enumerate(PACKED_PIECES, 1):
+    for _colour, _sign in ((0, 1), (1, -1)):
+        MATERIAL_VALUES[_code + 6 * _colour] = _sign * evaluation.PIECE_VALUES[_piece_class]
+        for _square in range(64):
+            SQUARE_SCORES[_code + 6 * _colour, _square] = _sign * evaluation.get_piece_score(
+                _piece_class, _colour, _square % 8, _square // 8)
+
+KING_DELTAS = pieces.ROOK_DIRECTIONS + pieces.BISHOP_DIRECTIONS
+
+# Number of positions evaluated at a time by main.
+CHUNK_SIZE = 65536
+
+# Bitboard masks
+FILE_MASKS = [0x0101010101010101 << x for x in range(8)]
+RANK_MASKS = [0xFF << (8 * y) for y in range(8)]
+# Squares that can be reached by moving delta_x files, without wrapping round to the other side of the board.
+SHIFT_MASKS = {delta_x: np.uint64(sum(FILE_MASKS[x] for x in range(8) if 0 <= x - delta_x <= 7))
+               for delta_x in range(-2, 3)}
+
+# Number of set bits in each byte
+POPCOUNTS = np.array([bin(byte).count('1') for byte in range(256)], np.int64)
+
+# Castling: (right, squares which must be empty, squares which must not be attacked, Rook's square), for white. Black's
+# rights are moved into the same bits when a position is seen from black's side. See get_relative_positions.
+CASTLING_PATHS = (
+    (WHITE_KING_SIDE, (61, 62), (60, 61, 62), 63),
+    (WHITE_QUEEN_SIDE, (57, 58, 59), (58, 59, 60), 56),
+)
+
+# Pseudo-legal moves for the side to move in each position of a batch. Each field is an (N,) array. Pawn moves to the
+# back rank count once for each possible promotion, as for Board.get_legal_moves.
+MoveCounts = namedtuple('MoveCounts', ['moves', 'captures', 'en_passant', 'castles', 'promotions'])
+
+# Features for a batch of positions. Each field is an array with one row per position.
+#     score, material -- (N,) centipawns, from white's side (or the side to move, if colours were given)
+#     mobility, king_attacks, pawn_shield, in_check -- (N, 2), for white then black
+BatchEvaluation = namedtuple('BatchEvaluation', ['score', 'material', 'mobility', 'king_attacks', 'pawn_shield',
+                                                 'in_check'])
+
+
+def get_packed_array(data):
+    # (N, PACKED_SIZE) uint8 array of packed positions stored end to end (see Board.pack), without copying them.
+    # data may be bytes, a bytearray or a memory-mapped file.
+    return np.frombuffer(data, np.uint8).reshape(-1, PACKED_SIZE)
+
+
+def pack_boards(boards):
+    return get_packed_array(b''.join(board.pack() for board in boards))
+
+
+def from_boards(boards):
+    # (squares, colours) for a list of Boards: the (N, 64) piece codes, and the (N,) active colours.
+    return from_packed(b''.join(board.pack() for board in boards))
+
+
+def from_packed(data):
+    # (squares, colours) for packed positions stored end to end, without copying the piece codes.
+    packed = get_packed_array(data).view(np.int8)
+    return packed[:, :64], packed[:, 64]
+
+
+def from_fens(fens):
+    return from_boards(Board.from_fen(fen) for fen in fens)
+
+
+def shift(grid, delta_x, delta_y):
+    # Move the values on each (8, 8) board in an (N, 8, 8) array by (delta_x, delta_y). grid[n, y, x] is square
+    # y * 8 + x of board n. Values moved off the board are lost, and squares left behind are 0.
+    result = np.zeros_like(grid)
+    target_y = slice(max(delta_y, 0), 8 + min(delta_y, 0))
+    target_x = slice(max(delta_x, 0), 8 + min(delta_x, 0))
+    source_y = slice(max(-delta_y, 0), 8 + min(-delta_y, 0))
+    source_x = slice(max(-delta_x, 0), 8 + min(-delta_x, 0))
+    result[:, target_y, target_x] = grid[:, source_y, source_x]
+    return result
+
+
+def get_attack_counts(squares):
+    # Number of pieces of each colour attacking each square: (N, 2, 64) uint8, white then black.
+    # As for Board.get_attack_counts, the opponent's King doesn't block the lines of ranged pieces.
+    grid = np.asarray(squares).reshape(-1, 8, 8)
+    counts = np.zeros((len(grid), 2, 8, 8), np.uint8)
+    occupied = grid != 0
+    for colour in (0, 1):
+        offset = 6 * colour
+        colour_counts = counts[:, colour]
+        blockers = occupied & (grid != KING + 6 - offset)
+        pawns = grid == PAWN + offset
+        step = 1 if colour else -1
+        for delta_x in (-1, 1):
+            colour_counts += shift(pawns, delta_x, step)
+        knights = grid == KNIGHT + offset
+        for delta_x, delta_y in pieces.KNIGHT_DELTAS:
+            colour_counts += shift(knights, delta_x, delta_y)
+        kings = grid == KING + offset
+        queens = grid == QUEEN + offset
+        for directions, sliders in ((pieces.ROOK_DIRECTIONS, (grid == ROOK + offset) | queens),
+                                    (pieces.BISHOP_DIRECTIONS, (grid == BISHOP + offset) | queens)):
+            for delta_x, delta_y in directions:
+                colour_counts += shift(kings, delta_x, delta_y)
+                # Two pieces can't attack the same square along the same direction: the one behind is blocked by the
+                # one in front. So the lines of all the pieces can be followed together.
+                line = shift(sliders, delta_x, delta_y)
+                while line.any():
+                    colour_counts += line
+                    line = shift(line & ~blockers, delta_x, delta_y)
+    return counts.reshape(-1, 2, 64)
+
+
+def evaluate_batch(squares, colours=None):
+    # BatchEvaluation for an (N, 64) array of piece codes. If the (N,) active colours are given, score and material
+    # are for the side to move, as evaluation.evaluate.
+    squares = np.asarray(squares)
+    codes = squares.astype(np.intp)
+    score = SQUARE_SCORES[codes, np.arange(64)].sum(axis=1)
+    material = MATERIAL_VALUES[codes].sum(axis=1)
+    if colours is not None:
+        sign = 1 - 2 * np.asarray(colours, np.int32)
+        score *= sign
+        material *= sign
+
+    counts = get_attack_counts(squares)
+    mobility = np.count_nonzero(counts, axis=2)
+
+    grid = squares.reshape(-1, 8, 8)
+    king_attacks = np.zeros((len(squares), 2), np.int32)
+    pawn_shield = np.zeros((len(squares), 2), np.int32)
+    in_check = np.zeros((len(squares), 2), bool)
+    for colour in (0, 1):
+        kings = grid == KING + 6 * colour
+        opponent_counts = counts[:, 1 - colour].reshape(-1, 8, 8)
+        zone = kings.copy()
+        for delta_x, delta_y in KING_DELTAS:
+            zone |= shift(kings, delta_x, delta_y)
+        king_attacks[:, colour] = (opponent_counts * zone).sum(axis=(1, 2))
+        in_check[:, colour] = (opponent_counts * kings).any(axis=(1, 2))
+
+        step = 1 if colour else -1
+        in_front = np.zeros_like(kings)
+        for delta_x in (-1, 0, 1):
+            in_front |= shift(kings, delta_x, step)
+        pawn_shield[:, colour] = np.count_nonzero(in_front & (grid == PAWN + 6 * colour), axis=(1, 2))
+    return BatchEvaluation(score, material, mobility, king_attacks, pawn_shield, in_check)
+
+
+def get_bitboards(squares):
+    # Bitboard of each piece code for each position: (13, N) uint64. bitboards[0] holds the empty squares.
+    squares = np.asarray(squares)
+    masks = squares[np.newaxis] == np.arange(13, dtype=squares.dtype)[:, np.newaxis, np.newaxis]
+    return np.packbits(masks, axis=2, bitorder='little').view('<u8')[..., 0].astype(np.uint64)
+
+
+def shift_bits(bitboards, amount):
+    return bitboards << np.uint64(amount) if amount > 0 else bitboards >> np.uint64(-amount)
+
+
+def shift_bitboards(bitboards, delta_x, delta_y):
+    # Move every piece on the bitboards by (delta_x, delta_y). Pieces moved off the board are lost.
+    return shift_bits(bitboards, delta_y * 8 + delta_x) & SHIFT_MASKS[delta_x]
+
+
+def popcount(bitboards):
+    # Number of squares on each bitboard
+    bitboards = np.ascontiguousarray(bitboards, np.uint64)
+    return POPCOUNTS[bitboards.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def get_line_attacks(sliders, empty, delta_x, delta_y):
+    # Squares attacked by the ranged pieces on the sliders bitboards along one direction. Lines stop at the first
+    # square which is not on the empty bitboards.
+    amount = delta_y * 8 + delta_x
+    empty = empty & SHIFT_MASKS[delta_x]
+    for distance in (1, 2, 4):
+        sliders = sliders | empty & shift_bits(sliders, amount * distance)
+        empty = empty & shift_bits(empty, amount * distance)
+    return shift_bitboards(sliders, delta_x, delta_y)
+
+
+def get_colour_attacks(bitboards, colour, empty):
+    # Squares attacked by the pieces of one colour: (N,) uint64. Lines of ranged pieces stop at squares not in empty.
+    offset = 6 * colour
+    step = 1 if colour else -1
+    attacks = shift_bitboards(bitboards[PAWN + offset], -1, step) | shift_bitboards(bitboards[PAWN + offset], 1, step)
+    for delta_x, delta_y in pieces.KNIGHT_DELTAS:
+        attacks |= shift_bitboards(bitboards[KNIGHT + offset], delta_x, delta_y)
+    for delta_x, delta_y in KING_DELTAS:
+        attacks |= shift_bitboards(bitboards[KING + offset], delta_x, delta_y)
+    queens = bitboards[QUEEN + offset]
+    for directions, sliders in ((pieces.ROOK_DIRECTIONS, bitboards[ROOK + offset] | queens),
+                                (pieces.BISHOP_DIRECTIONS, bitboards[BISHOP + offset] | queens)):
+        for delta_x, delta_y in directions:
+            attacks |= get_line_attacks(sliders, empty, delta_x, delta_y)
+    return attacks
+
+
+def get_attacks(squares):
+    # Squares attacked by each colour: (N, 2) uint64 bitboards, white then black. As for get_attack_counts, the
+    # opponent's King doesn't block the lines of ranged pieces.
+    bitboards = get_bitboards(squares)
+    return np.stack([get_colour_attacks(bitboards, colour, bitboards[0] | bitboards[KING + 6 - 6 * colour])
+                     for colour in (0, 1)], axis=1)
+
+
+def get_relative_positions(packed):
+    # (squares, castling, en_passant) for an (N, PACKED_SIZE) array of packed positions, seen from the side to move.
+    # When black is to move, the board is flipped vertically and the colours are swapped, so the side to move always
+    # has the white piece codes, the white castling rights, and pawns which move towards lower squares.
+    # en_passant is the square skipped by a pawn's double-move, or 64 if none.
+    black = packed[:, 64] == 1
+    squares = packed[:, :64].view(np.int8)
+    flipped = squares.reshape(-1, 8, 8)[:, ::-1].reshape(-1, 64)
+    flipped = np.where(flipped == 0, 0, (flipped + 5) % 12 + 1).astype(np.int8)
+    squares = np.where(black[:, np.newaxis], flipped, squares)
+    castling = packed[:, 65]
+    castling = np.where(black, castling >> 2 | (castling & 3) << 2, castling)
+    en_passant = packed[:, 66].astype(np.int64)
+    en_passant = np.where(black & (en_passant < 64), en_passant ^ 56, en_passant)
+    return squares, castling, en_passant
+
+
+def count_moves(packed):
+    # MoveCounts for an (N, PACKED_SIZE) array of packed positions (see get_packed_array and pack_boards).
+    squares, castling, en_passant = get_relative_positions(packed)
+    bitboards = get_bitboards(squares)
+    empty = bitboards[0]
+    own = np.bitwise_or.reduce(bitboards[PAWN:KING + 1])
+    enemy = np.bitwise_or.reduce(bitboards[PAWN + 6:])
+    not_own = ~own
+    moves = np.zeros(len(squares), np.int64)
+    captures = np.zeros(len(squares), np.int64)
+
+    # Pawns. Moves onto the back rank (y = 0) count once per promotion.
+    back_rank = np.uint64(RANK_MASKS[0])
+    pawns = bitboards[PAWN]
+    single = shift_bitboards(pawns, 0, -1) & empty
+    double = shift_bitboards(single & np.uint64(RANK_MASKS[5]), 0, -1) & empty
+    pawn_captures = shift_bitboards(pawns, -1, -1) & enemy, shift_bitboards(pawns, 1, -1) & enemy
+    promotions = 4 * (popcount(single & back_rank) + sum(popcount(targets & back_rank) for targets in pawn_captures))
+    moves += popcount(single & ~back_rank) + popcount(double)
+    for targets in pawn_captures:
+        moves += popcount(targets & ~back_rank)
+        captures += popcount(targets & ~back_rank) + 4 * popcount(targets & back_rank)
+    moves += promotions
+
+    # En-passant. Pawns which can capture on the square are diagonally behind it.
+    has_en_passant = en_passant < 64
+    en_passant_square = np.where(has_en_passant, np.uint64(1) << np.minimum(en_passant, 63).astype(np.uint64),
+                                 np.uint64(0))
+    en_passant_captures = (popcount(shift_bitboards(en_passant_square, -1, 1) & pawns) +
+                           popcount(shift_bitboards(en_passant_square, 1, 1) & pawns))
+    moves += en_passant_captures
+    captures += en_passant_captures
+
+    # Knights and King. Each delta gives a different target square for each piece, so counting the targets of each
+    # delta separately counts every move.
+    for piece_code, deltas in ((KNIGHT, pieces.KNIGHT_DELTAS), (KING, KING_DELTAS)):
+        for delta_x, delta_y in deltas:
+            targets = shift_bitboards(bitboards[piece_code], delta_x, delta_y)
+            moves += popcount(targets & not_own)
+            captures += popcount(targets & enemy)
+
+    # Ranged pieces. Along one direction, the line of a piece behind another stops at the one in front, so the lines
+    # of all the pieces never overlap and can be counted together.
+    queens = bitboards[QUEEN]
+    for directions, sliders in ((pieces.ROOK_DIRECTIONS, bitboards[ROOK] | queens),
+                                (pieces.BISHOP_DIRECTIONS, bitboards[BISHOP] | queens)):
+        for delta_x, delta_y in directions:
+            targets = get_line_attacks(sliders, empty, delta_x, delta_y)
+            moves += popcount(targets & not_own)
+            captures += popcount(targets & enemy)
+
+    # Castling
+    opponent_attacks = get_colour_attacks(bitboards, 1, empty)
+    castles = np.zeros(len(squares), np.int64)
+    for right, empty_squares, safe_squares, rook_square in CASTLING_PATHS:
+        empty_mask = np.uint64(sum(1 << square for square in empty_squares))
+        safe_mask = np.uint64(sum(1 << square for square in safe_squares))
+        rook = bitboards[ROOK] >> np.uint64(rook_square) & np.uint64(1)
+        castles += ((castling & right != 0) & (empty & empty_mask == empty_mask) & (opponent_attacks & safe_mask == 0) &
+                    (rook == 1))
+    moves += castles
+    return MoveCounts(moves, captures, en_passant_captures, castles, promotions)
+
+
+def read_chunks(args):
+    # (N, PACKED_SIZE) array of packed positions for each chunk of up to CHUNK_SIZE positions from the input file.
+    if args.archive:
+        # The positions are used in place in the mapped file
+        with archive.Archive(args.file) as games:
+            for start in range(0, games.position_count, CHUNK_SIZE):
+                yield get_packed_array(games.positions[start * PACKED_SIZE:(start + CHUNK_SIZE) * PACKED_SIZE])
+    elif args.packed:
+        with open(args.file, 'rb') as packed_file:
+            while True:
+                data = packed_file.read(CHUNK_SIZE * PACKED_SIZE)
+                if not data:
+                    return
+                yield get_packed_array(data)
+    else:
+        with open(args.file) as fen_file:
+            boards = []
+            for line in fen_file:
+                if line.strip():
+                    boards.append(Board.from_fen(line.strip()))
+                if len(boards) == CHUNK_SIZE:
+                    yield pack_boards(boards)
+                    boards = []
+            if boards:
+                yield pack_boards(boards)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Evaluate many positions at once.")
+    parser.add_argument('file', help="file of positions: one FEN per line, or packed positions with --packed")
+    parser.add_argument('--packed', action='store_true', help="read positions packed by Board.pack, end to end")
+    parser.add_argument('--archive', action='store_true', help="read the positions of a game archive (see archive.py)")
+    parser.add_argument('--moves', action='store_true', help="count pseudo-legal moves instead of evaluating")
+    args = parser.parse_args(args)
+
+    if args.moves:
+        print('\t'.join(MoveCounts._fields))
+    else:
+        print('score\tmaterial\tmobility\topponent_mobility\tking_attacks\tpawn_shield\tin_check')
+    positions = 0
+    seconds = 0
+    totals = [0] * len(MoveCounts._fields)
+    for packed in read_chunks(args):
+        start = time.perf_counter()
+        squares, colours = packed[:, :64].view(np.int8), packed[:, 64]
+        result = count_moves(packed) if args.moves else evaluate_batch(squares, colours)
+        seconds += time.perf_counter() - start
+        positions += len(packed)
+
+        if args.moves:
+            totals = [total + int(values.sum()) for total, values in zip(totals, result)]
+            rows = zip(*result)
+        else:
+            # Features for the side to move first
+            indices = np.arange(len(packed))
+            own, opponent = colours.astype(np.intp), 1 - colours.astype(np.intp)
+            rows = zip(result.score, result.material, result.mobility[indices, own],
+                       result.mobility[indices, opponent], result.king_attacks[indices, own],
+                       result.pawn_shield[indices, own], result.in_check[indices, own].astype(int))
+        for values in rows:
+            print('\t'.join(str(value) for value in values))
+
+    if args.moves:
+        print(', '.join('%s: %d' % total for total in zip(MoveCounts._fields, totals)), file=sys.stderr)
+    print("%d positions in %.2fs (%.0f positions/s)" %
+          (positions, seconds, positions / seconds if seconds else 0), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
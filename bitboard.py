@@ -0,0 +1,410 @@
+# Bitboard representation of a position, used as a faster alternative to moving pieces around Board.piece_grid.
+#
+# A bitboard is an int with one bit per square. Squares are numbered square = y * 8 + x, using the same (x, y)
+# coordinates as Board.piece_grid[x][y], so square 0 is the top-left corner of the board (a8) and square 63 is the
+# bottom-right corner (h1). White pawns move towards lower square numbers.
+#
+# Attacks for Knights, Kings and Pawns are looked up in tables computed once, when the module is imported.
+# Attacks for ranged pieces are looked up by the occupancy of the squares on their paths. This works the same way as
+# magic bitboards, except the occupancy is used directly as a dictionary key instead of being hashed by a magic number.
+
+import copy
+import random
+import time
+
+from board import Board, Move, WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE, BLACK_QUEEN_SIDE
+import pieces
+
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+PIECE_TYPES = {pieces.Pawn: PAWN, pieces.Knight: KNIGHT, pieces.Bishop: BISHOP,
+               pieces.Rook: ROOK, pieces.Queen: QUEEN, pieces.King: KING}
+PIECE_CLASSES = pieces.Pawn, pieces.Knight, pieces.Bishop, pieces.Rook, pieces.Queen, pieces.King
+
+ALL_SQUARES = (1 << 64) - 1
+
+KING_DELTAS = (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)
+
+
+def bit(x, y):
+    return 1 << (y * 8 + x)
+
+
+def squares(bitboard):
+    # Square numbers of all set bits, lowest first.
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+def get_leaper_attacks(deltas):
+    table = []
+    for square in range(64):
+        x, y = square % 8, square // 8
+        attacks = 0
+        for delta_x, delta_y in deltas:
+            if 0 <= x + delta_x < 8 and 0 <= y + delta_y < 8:
+                attacks |= bit(x + delta_x, y + delta_y)
+        table.append(attacks)
+    return table
+
+
+def get_ray_attacks(square, directions, occupied):
+    # Walk each ray until the edge of the board or the first occupied square (which is included).
+    attacks = 0
+    for delta_x, delta_y in directions:
+        x, y = square % 8 + delta_x, square // 8 + delta_y
+        while 0 <= x < 8 and 0 <= y < 8:
+            attacks |= bit(x, y)
+            if occupied & bit(x, y):
+                break
+            x, y = x + delta_x, y + delta_y
+    return attacks
+
+
+def get_relevant_occupancy_mask(square, directions):
+    # Squares whose occupancy can change the attacks of a ranged piece. The last square of each ray is excluded, since
+    # it is attacked whether or not it is occupied.
+    mask = 0
+    for delta_x, delta_y in directions:
+        x, y = square % 8 + delta_x, square // 8 + delta_y
+        while 0 <= x + delta_x < 8 and 0 <= y + delta_y < 8:
+            mask |= bit(x, y)
+            x, y = x + delta_x, y + delta_y
+    return mask
+
+
+def get_subsets(mask):
+    # Every subset of the bits in mask, including 0 and mask itself.
+    subset = 0
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if not subset:
+            return
+
+
+def get_sliding_tables(directions):
+    masks, tables = [], []
+    for square in range(64):
+        mask = get_relevant_occupancy_mask(square, directions)
+        masks.append(mask)
+        tables.append({occupied: get_ray_attacks(square, directions, occupied) for occupied in get_subsets(mask)})
+    return masks, tables
+
+
+def get_between_table():
+    # between[a][b] => squares strictly between a and b if they share a rank, file or diagonal, otherwise 0.
+    table = [[0] * 64 for _ in range(64)]
+    for square in range(64):
+        for delta_x, delta_y in pieces.ROOK_DIRECTIONS + pieces.BISHOP_DIRECTIONS:
+            x, y = square % 8 + delta_x, square // 8 + delta_y
+            path = 0
+            while 0 <= x < 8 and 0 <= y < 8:
+                table[square][y * 8 + x] = path
+                path |= bit(x, y)
+                x, y = x + delta_x, y + delta_y
+    return table
+
+
+KNIGHT_ATTACKS = get_leaper_attacks(pieces.KNIGHT_DELTAS)
+KING_ATTACKS = get_leaper_attacks(KING_DELTAS)
+# PAWN_ATTACKS[colour][square] => squares attacked by a pawn of that colour on square.
+PAWN_ATTACKS = get_leaper_attacks(((-1, -1), (1, -1))), get_leaper_attacks(((-1, 1), (1, 1)))
+ROOK_MASKS, ROOK_TABLES = get_sliding_tables(pieces.ROOK_DIRECTIONS)
+BISHOP_MASKS, BISHOP_TABLES = get_sliding_tables(pieces.BISHOP_DIRECTIONS)
+BETWEEN = get_between_table()
+
+# Castling rights kept after a piece moves from or to a square. Moving the King or a Rook, or capturing a Rook,
+# removes the matching rights.
+CASTLING_MASKS = [ALL_SQUARES] * 64
+CASTLING_MASKS[7 * 8 + 4] = ~(WHITE_KING_SIDE | WHITE_QUEEN_SIDE)
+CASTLING_MASKS[7 * 8 + 7] = ~WHITE_KING_SIDE
+CASTLING_MASKS[7 * 8 + 0] = ~WHITE_QUEEN_SIDE
+CASTLING_MASKS[0 * 8 + 4] = ~(BLACK_KING_SIDE | BLACK_QUEEN_SIDE)
+CASTLING_MASKS[0 * 8 + 7] = ~BLACK_KING_SIDE
+CASTLING_MASKS[0 * 8 + 0] = ~BLACK_QUEEN_SIDE
+
+
+def rook_attacks(square, occupied):
+    return ROOK_TABLES[square][occupied & ROOK_MASKS[square]]
+
+
+def bishop_attacks(square, occupied):
+    return BISHOP_TABLES[square][occupied & BISHOP_MASKS[square]]
+
+
+class BitboardPosition:
+    def __init__(self):
+        # pieces[colour][piece_type] => bitboard of that colour's pieces of that type.
+        self.pieces = [[0] * 6, [0] * 6]
+        # occupied[colour] => bitboard of all pieces of that colour.
+        self.occupied = [0, 0]
+        self.active_colour = 0
+        self.castling = 0
+        # Square skipped over by a pawn double-move on the previous turn, otherwise None.
+        self.en_passant = None
+
+    @classmethod
+    def from_board(cls, board):
+        position = cls()
+        for x in range(8):
+            for y in range(8):
+                piece = board.piece_grid[x][y]
+                if piece:
+                    position.pieces[piece.colour][PIECE_TYPES[type(piece)]] |= bit(x, y)
+                    position.occupied[piece.colour] |= bit(x, y)
+        position.active_colour = int(board.active_colour)
+
+        position.castling = board.get_castling_rights()
+        position.en_passant = board.en_passant
+        return position
+
+    def copy(self):
+        position = BitboardPosition()
+        position.pieces = [self.pieces[0][:], self.pieces[1][:]]
+        position.occupied = self.occupied[:]
+        position.active_colour = self.active_colour
+        position.castling = self.castling
+        position.en_passant = self.en_passant
+        return position
+
+    def get_piece_type(self, colour, square):
+        mask = 1 << square
+        for piece_type, bitboard in enumerate(self.pieces[colour]):
+            if bitboard & mask:
+                return piece_type
+        return None
+
+    def get_attackers(self, square, colour, occupied):
+        # Pieces of colour attacking square, given the occupancy of the board.
+        own = self.pieces[colour]
+        return (KNIGHT_ATTACKS[square] & own[KNIGHT]) | (KING_ATTACKS[square] & own[KING]) | \
+            (PAWN_ATTACKS[not colour][square] & own[PAWN]) | \
+            (bishop_attacks(square, occupied) & (own[BISHOP] | own[QUEEN])) | \
+            (rook_attacks(square, occupied) & (own[ROOK] | own[QUEEN]))
+
+    def is_check(self, colour=None):
+        if colour is None:
+            colour = self.active_colour
+        king_square = self.pieces[colour][KING].bit_length() - 1
+        return bool(self.get_attackers(king_square, not colour, self.occupied[0] | self.occupied[1]))
+
+    def get_legal_moves(self):
+        # Same result as Board.get_legal_moves for the player whose turn it is.
+        # Checking pieces and pinned pieces are found once, so only King moves and en-passant captures are tested by
+        # looking for attacks on the King after the move.
+        colour = self.active_colour
+        opponent = not colour
+        own, opponent_pieces = self.pieces[colour], self.pieces[opponent]
+        own_occupied, opponent_occupied = self.occupied[colour], self.occupied[opponent]
+        occupied = own_occupied | opponent_occupied
+        moves = []
+
+        king_square = own[KING].bit_length() - 1
+        king_x, king_y = king_square % 8, king_square // 8
+        checkers = self.get_attackers(king_square, opponent, occupied)
+
+        # King moves. The King is removed from the board so it can't hide behind itself on a ray.
+        occupied_without_king = occupied ^ own[KING]
+        for target in squares(KING_ATTACKS[king_square] & ~own_occupied):
+            if not self.get_attackers(target, opponent, occupied_without_king):
+                moves.append(Move(king_x, king_y, target % 8, target // 8))
+
+        if checkers & (checkers - 1):
+            # Double check. Only the King can move.
+            return moves
+
+        if checkers:
+            # Must capture the checking piece or block its path.
+            checker_square = checkers.bit_length() - 1
+            target_mask = checkers | BETWEEN[king_square][checker_square]
+        else:
+            target_mask = ALL_SQUARES
+            self.add_castling_moves(moves, king_square, occupied)
+
+        # Pinned pieces may only move along the line between the King and the pinning piece.
+        pin_masks = {}
+        snipers = (rook_attacks(king_square, 0) & (opponent_pieces[ROOK] | opponent_pieces[QUEEN])) | \
+            (bishop_attacks(king_square, 0) & (opponent_pieces[BISHOP] | opponent_pieces[QUEEN]))
+        for sniper in squares(snipers):
+            blockers = BETWEEN[king_square][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own_occupied:
+                pin_masks[blockers.bit_length() - 1] = BETWEEN[king_square][sniper] | (1 << sniper)
+
+        targets = ~own_occupied & target_mask
+        for piece_type, get_attacks in ((KNIGHT, None), (BISHOP, bishop_attacks), (ROOK, rook_attacks),
+                                        (QUEEN, None)):
+            for square in squares(own[piece_type]):
+                if piece_type == KNIGHT:
+                    attacks = KNIGHT_ATTACKS[square]
+                elif piece_type == QUEEN:
+                    attacks = rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+                else:
+                    attacks = get_attacks(square, occupied)
+                attacks &= targets & pin_masks.get(square, ALL_SQUARES)
+                x, y = square % 8, square // 8
+                for target in squares(attacks):
+                    moves.append(Move(x, y, target % 8, target // 8))
+
+        self.add_pawn_moves(moves, king_square, target_mask, pin_masks, occupied)
+        return moves
+
+    def add_pawn_moves(self, moves, king_square, target_mask, pin_masks, occupied):
+        colour = self.active_colour
+        opponent = not colour
+        push = 8 if colour else -8
+        start_row, promotion_row = (1, 7) if colour else (6, 0)
+        opponent_occupied = self.occupied[opponent]
+
+        for square in squares(self.pieces[colour][PAWN]):
+            x, y = square % 8, square // 8
+            allowed = target_mask & pin_masks.get(square, ALL_SQUARES)
+
+            targets = PAWN_ATTACKS[colour][square] & opponent_occupied
+            forward = square + push
+            if not occupied & (1 << forward):
+                targets |= 1 << forward
+                if y == start_row and not occupied & (1 << (forward + push)):
+                    targets |= 1 << (forward + push)
+            targets &= allowed
+
+            for target in squares(targets):
+                if target // 8 == promotion_row:
+                    for promotion in Board.possible_promotions:
+                        moves.append(Move(x, y, target % 8, target // 8, promotion))
+                else:
+                    moves.append(Move(x, y, target % 8, target // 8))
+
+            if self.en_passant is not None and PAWN_ATTACKS[colour][square] & (1 << self.en_passant):
+                if self.is_legal_en_passant(square, king_square, occupied):
+                    moves.append(Move(x, y, self.en_passant % 8, self.en_passant // 8))
+
+    def is_legal_en_passant(self, square, king_square, occupied):
+        # Two pawns leave the same rank at once, which can expose the King in ways a pin can't describe.
+        # Test the resulting position directly.
+        colour = self.active_colour
+        opponent = not colour
+        captured = self.en_passant - (8 if colour else -8)
+        occupied = (occupied ^ (1 << square) ^ (1 << captured)) | (1 << self.en_passant)
+        opponent_pieces = self.pieces[opponent]
+        return not ((KNIGHT_ATTACKS[king_square] & opponent_pieces[KNIGHT]) or
+                    (PAWN_ATTACKS[colour][king_square] & opponent_pieces[PAWN] & ~(1 << captured)) or
+                    (bishop_attacks(king_square, occupied) & (opponent_pieces[BISHOP] | opponent_pieces[QUEEN])) or
+                    (rook_attacks(king_square, occupied) & (opponent_pieces[ROOK] | opponent_pieces[QUEEN])))
+
+    def add_castling_moves(self, moves, king_square, occupied):
+        # Only called when the King is not in check.
+        colour = self.active_colour
+        opponent = not colour
+        king_side, queen_side = (BLACK_KING_SIDE, BLACK_QUEEN_SIDE) if colour else (WHITE_KING_SIDE, WHITE_QUEEN_SIDE)
+        rank = king_square // 8
+        if self.castling & king_side and not occupied & (bit(5, rank) | bit(6, rank)):
+            if not any(self.get_attackers(rank * 8 + file, opponent, occupied) for file in (5, 6)):
+                moves.append(Move(4, rank, 6, rank))
+        if self.castling & queen_side and not occupied & (bit(1, rank) | bit(2, rank) | bit(3, rank)):
+            if not any(self.get_attackers(rank * 8 + file, opponent, occupied) for file in (2, 3)):
+                moves.append(Move(4, rank, 2, rank))
+
+    def make_move(self, move):
+        # Return the position after the move. The move must be legal. This position is not changed.
+        position = self.copy()
+        colour = self.active_colour
+        opponent = not colour
+        own, opponent_pieces = position.pieces[colour], position.pieces[opponent]
+        start, target = move.y * 8 + move.x, move.new_y * 8 + move.new_x
+        start_bit, target_bit = 1 << start, 1 << target
+        piece_type = self.get_piece_type(colour, start)
+
+        # Captures
+        if self.occupied[opponent] & target_bit:
+            captured_type = self.get_piece_type(opponent, target)
+            opponent_pieces[captured_type] ^= target_bit
+            position.occupied[opponent] ^= target_bit
+        elif piece_type == PAWN and target == self.en_passant:
+            captured_bit = 1 << (target - (8 if colour else -8))
+            opponent_pieces[PAWN] ^= captured_bit
+            position.occupied[opponent] ^= captured_bit
+
+        # Move the piece
+        own[piece_type] ^= start_bit
+        own[PIECE_TYPES[move.promotion] if move.promotion else piece_type] |= target_bit
+        position.occupied[colour] ^= start_bit | target_bit
+
+        # Castling moves the Rook too
+        if piece_type == KING and abs(move.new_x - move.x) == 2:
+            rook_start, rook_target = (7, 5) if move.new_x > move.x else (0, 3)
+            rook_bits = bit(rook_start, move.y) | bit(rook_target, move.y)
+            own[ROOK] ^= rook_bits
+            position.occupied[colour] ^= rook_bits
+
+        position.castling &= CASTLING_MASKS[start] & CASTLING_MASKS[target]
+        if piece_type == PAWN and abs(target - start) == 16:
+            position.en_passant = (start + target) // 2
+        else:
+            position.en_passant = None
+        position.active_colour = int(opponent)
+        return position
+
+
+def get_sample_boards(count=20, seed=1):
+    # Positions reached by playing random legal moves from the starting position.
+    rng = random.Random(seed)
+    boards = []
+    board = Board()
+    ply = 0
+    while len(boards) < count:
+        moves = board.get_legal_moves()
+        if not moves or ply == 60:
+            # Start a new game
+            board = Board()
+            ply = 0
+            continue
+        ply += 1
+        board.make_move(rng.choice(moves))
+        boards.append(board)
+        board = copy.deepcopy(board)
+    return boards
+
+
+def benchmark(boards, repeat=5):
+    # Time legal move generation for each board, using both Board.piece_grid and bitboards.
+    # Returns (piece_grid seconds, bitboard seconds, bitboard seconds including conversion).
+    positions = [BitboardPosition.from_board(board) for board in boards]
+    for board, position in zip(boards, positions):
+        assert sorted(board.get_legal_moves(), key=str) == sorted(position.get_legal_moves(), key=str)
+
+    # Board keeps the legal moves, check info and attack maps of its position, so they are cleared before each call:
+    # both generators then work the moves out from scratch.
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for board in boards:
+            board.clear_caches()
+            board.get_legal_moves()
+    grid_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for position in positions:
+            position.get_legal_moves()
+    bitboard_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for board in boards:
+            BitboardPosition.from_board(board).get_legal_moves()
+    conversion_time = time.perf_counter() - start
+    return grid_time, bitboard_time, conversion_time
+
+
+if __name__ == '__main__':
+    sample_boards = get_sample_boards(200)
+    grid_seconds, bitboard_seconds, conversion_seconds = benchmark(sample_boards)
+    calls = 5 * len(sample_boards)
+    print("Legal move generation, %d calls" % calls)
+    print("  piece_grid:             %8.1f us/call" % (grid_seconds / calls * 1e6))
+    print("  bitboard:               %8.1f us/call (%.1fx)" % (bitboard_seconds / calls * 1e6,
+                                                              grid_seconds / bitboard_seconds))
+    print("  bitboard + conversion:  %8.1f us/call (%.1fx)" % (conversion_seconds / calls * 1e6,
+                                                              grid_seconds / conversion_seconds))
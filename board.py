@@ -1,42 +1,156 @@
-import pygame
+from collections import namedtuple
+
 import exceptions
 import pieces
+from zobrist import PIECE_KEYS, BLACK_TO_MOVE_KEY, CASTLING_KEYS, EN_PASSANT_KEYS
 
 
-class Board:
-    def __init__(self):
-        self.tile_size = 65
-        self.x_offset = 200
-        self.y_offset = 100
+FILES = 'abcdefgh'
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Castling rights. Bit set => the player may still castle on that side.
+WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE, BLACK_QUEEN_SIDE = 1, 2, 4, 8
+
+# Piece classes in the order used by packed positions. See Board.pack.
+PACKED_PIECES = pieces.Pawn, pieces.Knight, pieces.Bishop, pieces.Rook, pieces.Queen, pieces.King
+
+# Size of a packed position in bytes.
+#
+# Memory per position (64-bit CPython 3, measured with tracemalloc):
+#     Board with a full set of pieces -- about 9 KB. Each piece is a __slots__ object of 96 bytes, plus its
+#                                        valid_moves and protected_squares lists. About 20 KB more once its
+#                                        attack maps are built (see Board.get_attack_counts).
+#     packed position (bytes object) -- 103 bytes: PACKED_SIZE plus the bytes object header.
+#     packed positions stored end to end in one bytearray -- PACKED_SIZE bytes each, so 1 million positions take
+#                                                             70 MB.
+PACKED_SIZE = 70
+
+# Directions of the lines along which each ranged piece attacks.
+RANGED_DIRECTIONS = {
+    pieces.Rook: pieces.ROOK_DIRECTIONS,
+    pieces.Bishop: pieces.BISHOP_DIRECTIONS,
+    pieces.Queen: pieces.ROOK_DIRECTIONS + pieces.BISHOP_DIRECTIONS,
+}
+
+# Squares (y * 8 + x) attacked by a Knight or King standing on each square.
+KNIGHT_ATTACKS = [[(y + delta_y) * 8 + x + delta_x for delta_x, delta_y in pieces.KNIGHT_DELTAS
+                   if 0 <= x + delta_x <= 7 and 0 <= y + delta_y <= 7] for y in range(8) for x in range(8)]
+KING_ATTACKS = [[(y + delta_y) * 8 + x + delta_x for delta_x, delta_y in RANGED_DIRECTIONS[pieces.Queen]
+                 if 0 <= x + delta_x <= 7 and 0 <= y + delta_y <= 7] for y in range(8) for x in range(8)]
+
+# FEN character for each piece, and the piece and colour for each FEN character.
+FEN_PIECES = {(piece_class, colour): piece_class.symbol.upper() if colour == 0 else piece_class.symbol
+              for piece_class in PACKED_PIECES for colour in (0, 1)}
+FEN_CHARACTERS = {char: piece for piece, char in FEN_PIECES.items()}
+
+
+class Move(namedtuple('Move', ['x', 'y', 'new_x', 'new_y', 'promotion'], defaults=[None])):
+    # A single move by the piece on (x, y) to (new_x, new_y).
+    # promotion is the piece class a pawn is promoted to when reaching the back rank, otherwise None.
+    __slots__ = ()
+
+    @staticmethod
+    def get_square_name(x, y):
+        # eg: (4, 6) => 'e2'
+        return FILES[x] + str(8 - y)
+
+    def __str__(self):
+        # Coordinate notation, eg: 'e2e4', 'e7e8q'
+        promotion = self.promotion.symbol if self.promotion else ''
+        return self.get_square_name(self.x, self.y) + self.get_square_name(self.new_x, self.new_y) + promotion
+
+    def encode(self):
+        # Pack the move into 16 bits, using the same layout as Polyglot opening books:
+        #     bits 0 - 2: target file, 3 - 5: target rank, 6 - 8: start file, 9 - 11: start rank,
+        #     12 - 14: promotion (0 => none, 1 => Knight, 2 => Bishop, 3 => Rook, 4 => Queen)
+        # Ranks are counted from white's side (rank = 7 - y).
+        promotion = PROMOTION_CODES.index(self.promotion)
+        return self.new_x | (7 - self.new_y) << 3 | self.x << 6 | (7 - self.y) << 9 | promotion << 12
+
+    @classmethod
+    def decode(cls, code):
+        return cls(code >> 6 & 7, 7 - (code >> 9 & 7), code & 7, 7 - (code >> 3 & 7), PROMOTION_CODES[code >> 12 & 7])
 
-        self.tiles = pygame.image.load("assets/board-tiles.png").convert()
-        self.labels_white = pygame.image.load("assets/board-white-labels.png").convert_alpha()
-        self.labels_black = pygame.image.load("assets/board-black-labels.png").convert_alpha()
 
-        self.moves_overlay = self.get_surface(self.tile_size, self.tile_size, (0, 204, 0), 80)
-        self.check_overlay = self.get_surface(self.tile_size, self.tile_size, (204, 204, 0), 80)
+# Promotion piece for each value of bits 12 - 14 in an encoded move
+PROMOTION_CODES = None, pieces.Knight, pieces.Bishop, pieces.Rook, pieces.Queen
 
-        self.pawn_promotions_white = pygame.image.load("assets/w_pawn_promotions.png").convert_alpha()
-        self.pawn_promotions_black = pygame.image.load("assets/b_pawn_promotions.png").convert_alpha()
 
+class Board:
+    # Rules-only representation of a chess position. Does not depend on pygame, and does not load any assets, so it can
+    # be used without a display. See graphics.GraphicalBoard for the version of the board drawn on screen.
+
+    possible_promotions = pieces.Queen, pieces.Rook, pieces.Bishop, pieces.Knight
+
+    def __init__(self, fen=None, packed=None):
+        # Starts from the normal starting position, or from the position in Forsyth-Edwards Notation or packed bytes
+        # (see pack) if given.
         self.piece_grid = self.get_grid(8, 8)
 
         # Bitlists for pieces active in the game (not captured).
-        # Each piece has an ID (piece.id) which gives its position in the list. The pawns have IDs 0 - 7 going from file
-        # 1 to file 8 (x = 0 to x = 7). The back pieces are numbered similarly, but with 8 - 15.
-        # The IDs for corresponding white and black pieces are the same (eg: White King == Black King == 12).
+        # Each piece has an ID (piece.id) which gives its position in the list. In the starting position, the pawns
+        # have IDs 0 - 7 going from file 1 to file 8 (x = 0 to x = 7). The back pieces are numbered similarly, but with
+        # 8 - 15. Positions loaded from FEN use the same IDs where possible, but any free ID may be given out.
+        # Use self.kings to find the Kings, rather than their IDs.
         # pieces[0] => white pieces, pieces[1] => black pieces
         self.pieces = [None] * 16, [None] * 16
 
-        # Bitlist for an en-passant pawn of each colour. index 0 => white, index 1 => black.
-        # Only one may exist for each colour at a time. Must be cleared after the opponent's turn.
-        self.en_passant_pawns = [None, None]
+        # King of each colour. index 0 => white, index 1 => black.
+        self.kings = [None, None]
+
+        # Square (y * 8 + x) skipped by a pawn's double-move on the last turn, which the active player's pawns can
+        # capture en-passant. None if the last move wasn't a double-move.
+        self.en_passant = None
+
+        # 0 => white, 1 => black
+        self.active_colour = 0
+
+        # Number of moves by either player since the last capture or pawn move, for the fifty-move rule.
+        self.halfmove_clock = 0
+        # Starts at 1, and goes up after each of black's moves.
+        self.fullmove_number = 1
+
+        # Pieces checking each King, and pinned pieces of each colour. See get_check_info.
+        # Calculated when first needed, and cleared whenever the board changes.
+        self.check_info = [None, None]
 
-        # Groups to quickly draw pieces of each colour
-        # piece_sprites[0] => white sprites, piece_sprites[1] => black sprites
-        self.piece_sprites = pygame.sprite.Group(), pygame.sprite.Group()
+        # Legal moves for the active player in the current position. See get_legal_moves.
+        # Calculated when first needed, and cleared whenever the board changes.
+        self.legal_moves = None
 
-        self.set_pieces()
+        # Attack maps: {piece: list of the squares (y * 8 + x) it attacks}, for each colour the number of its pieces
+        # attacking each square, and for each square the set of ranged pieces attacking it. See get_attack_counts.
+        # Built when first needed, then updated in place by make_move for the pieces the move affects. unmake_move
+        # puts back the old squares of those pieces.
+        self.piece_attacks = None
+        self.attack_counts = None
+        self.ranged_attackers = None
+
+        # Undo records for moves played with make_move(). See make_move.
+        self.undo_stack = []
+
+        if packed:
+            self.set_packed(packed)
+        elif fen:
+            self.set_fen(fen)
+        else:
+            self.set_pieces()
+
+        # 64-bit Zobrist hash of the position, updated by make_move(). See zobrist.py.
+        self.zobrist_key = self.get_zobrist_key()
+        # Hash before each move in undo_stack.
+        self.key_history = []
+        # Changes to the attack maps made by each move in undo_stack: list of (piece, squares it attacked before the
+        # move, or None), or None if the maps weren't built at the time.
+        self.attack_history = []
+        # Number of times each position has occurred in the game. {hash: count}
+        self.position_counts = {self.zobrist_key: 1}
+
+    @classmethod
+    def from_fen(cls, fen):
+        # New board with the position in Forsyth-Edwards Notation. Pieces are placed directly, without setting up the
+        # starting position first, and without loading any assets, so it is cheap enough to load large test suites.
+        return cls(fen)
 
     @staticmethod
     def get_grid(m, n):
@@ -45,48 +159,31 @@ class Board:
             grid.append([None] * n)
         return grid
 
-    @staticmethod
-    def get_surface(width, height, colour, alpha):
-        surface = pygame.Surface((width, height))
-        surface.fill(colour)
-        surface.set_alpha(alpha)
-        return surface
-
-    def get_board_coords(self, x, y):
-        x, y = (x - self.x_offset) // self.tile_size, (y - self.y_offset) // self.tile_size
-        if x < 0 or x > 7 or y < 0 or y > 7:
-            raise ValueError("Coordinates are not on the board")
-        return x, y
-
-    def get_pixel_coords(self, x, y):
-        # Pixel coordinates relative to top-left corner of the display window.
-        return x * self.tile_size + self.x_offset, y * self.tile_size + self.y_offset
-
-    def add_piece_sprite(self, piece):
-        self.piece_sprites[piece.colour].add(piece.sprite)
-
-    def create_piece_on_board(self, piece_class, colour, file, rank, piece_id=None, pawn=None):
-        if piece_class == pieces.EnPassantPawn:
-            assert pawn is not None
-            piece = piece_class(colour, file, rank, self, pawn)
-            self.en_passant_pawns[colour] = piece
-        else:
-            piece = piece_class(colour, file, rank, self, piece_id)
-            self.pieces[colour][piece_id] = piece
-            self.add_piece_sprite(piece)
+    def create_piece_on_board(self, piece_class, colour, file, rank, piece_id):
+        piece = piece_class(colour, file, rank, self, piece_id)
+        self.pieces[colour][piece_id] = piece
+        if piece_class == pieces.King:
+            self.kings[colour] = piece
         self.piece_grid[file][rank] = piece
-
-    def remove_expired_en_passant_pawn(self, colour):
-        ep_pawn = self.en_passant_pawns[colour]
-        self.en_passant_pawns[colour] = None
-
-        pawn_space = self.piece_grid[ep_pawn.x][ep_pawn.y]
-        if isinstance(pawn_space, pieces.EnPassantPawn):
-            self.piece_grid[ep_pawn.x][ep_pawn.y] = None
+        self.check_info = [None, None]
+        self.legal_moves = None
+        return piece
+
+    def get_en_passant_pawn(self):
+        # The pawn which can be captured en-passant by the active player, or None.
+        if self.en_passant is None:
+            return None
+        x, y = self.en_passant % 8, self.en_passant // 8
+        return self.piece_grid[x][y - 1 if self.active_colour else y + 1]
+
+    def end_turn(self):
+        # Switch players. An en-passant capture is only possible on the turn straight after the double-move.
+        self.active_colour = int(not self.active_colour)
+        self.en_passant = None
 
     def set_pieces(self):
         # Create pieces in starting position on the board.
-        # Add pieces to bitlists for each colour, add to piece_grid, add sprites to groups.
+        # Add pieces to bitlists for each colour, add to piece_grid.
 
         piece_classes = [pieces.Rook, pieces.Knight, pieces.Bishop, pieces.Queen,
                          pieces.King, pieces.Bishop, pieces.Knight, pieces.Rook]
@@ -99,123 +196,681 @@ class Board:
                 # Back row pieces
                 self.create_piece_on_board(piece_classes[file], colour, file, back_rank, file + 8)
 
-    def capture(self, piece, capturing_piece):
-        if isinstance(piece, pieces.EnPassantPawn):
-            if isinstance(capturing_piece, pieces.Pawn):
-                # Remove en-passant pawn
-                self.en_passant_pawns[piece.colour] = None
-
-                # Capture pawn
-                piece = piece.pawn
-                self.capture(piece, None)
-                # No need to pass capturing_piece, since it is guaranteed that 'piece' won't be another EnPassantPawn.
-                # Must remove captured pawn from piece_grid manually, since nothing will move to take its place.
-                self.piece_grid[piece.x][piece.y] = None
+    def set_fen(self, fen):
+        # Place pieces from a position in Forsyth-Edwards Notation, on an empty board.
+        # eg: 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+        # The move clocks may be left out, and default to '0 1'.
+        fields = fen.split()
+        if not 4 <= len(fields) <= 6:
+            raise ValueError("FEN must have 4 to 6 fields: " + fen)
+        placement, active_colour, castling, en_passant = fields[:4]
+        clocks = fields[4:]
+        if not all(clock.isdigit() for clock in clocks):
+            raise ValueError("Invalid move clocks in FEN: " + fen)
+        self.halfmove_clock = int(clocks[0]) if len(clocks) > 0 else 0
+        self.fullmove_number = int(clocks[1]) if len(clocks) > 1 else 1
+
+        # Find every piece first, so IDs can be given out in order of preference.
+        found = [], []
+        ranks = placement.split('/')
+        if len(ranks) != 8:
+            raise ValueError("FEN must describe 8 ranks: " + fen)
+        for y, rank in enumerate(ranks):
+            x = 0
+            for char in rank:
+                if char in FEN_CHARACTERS and x < 8:
+                    piece_class, colour = FEN_CHARACTERS[char]
+                    found[colour].append((piece_class, x, y))
+                    x += 1
+                elif char in '12345678':
+                    x += int(char)
+                else:
+                    raise ValueError("Invalid FEN rank: " + rank)
+            if x != 8:
+                raise ValueError("Invalid FEN rank: " + rank)
+
+        if active_colour not in ('w', 'b'):
+            raise ValueError("Invalid active colour in FEN: " + active_colour)
+        rights = 0
+        for char, bit in zip('KQkq', (WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE, BLACK_QUEEN_SIDE)):
+            if char in castling:
+                rights |= bit
+        if en_passant != '-':
+            # The square skipped by a pawn of the player who is not moving: rank 3 after a white double-move, rank 6
+            # after a black one.
+            rank = '3' if active_colour == 'b' else '6'
+            if len(en_passant) != 2 or en_passant[0] not in FILES or en_passant[1] != rank:
+                raise ValueError("Invalid en-passant square in FEN: " + en_passant)
+            en_passant = FILES.index(en_passant[0]), 8 - int(en_passant[1])
         else:
-            self.pieces[piece.colour][piece.id] = None
-            piece.sprite.kill()
-        # Don't need to remove piece off piece_grid, since it will be replaced when the capturing piece is moved.
+            en_passant = None
+        self.set_position(found, 1 if active_colour == 'b' else 0, rights, en_passant)
+
+    def to_fen(self):
+        # The position in Forsyth-Edwards Notation, including the move clocks.
+        ranks = []
+        for y in range(8):
+            rank = ''
+            empty = 0
+            for x in range(8):
+                piece = self.piece_grid[x][y]
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += FEN_PIECES[type(piece), piece.colour]
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+
+        rights = self.get_castling_rights()
+        castling = ''.join(char for char, bit in zip('KQkq', (WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE,
+                                                               BLACK_QUEEN_SIDE)) if rights & bit) or '-'
+        en_passant = '-' if self.en_passant is None else Move.get_square_name(self.en_passant % 8,
+                                                                              self.en_passant // 8)
+        return ' '.join(('/'.join(ranks), 'b' if self.active_colour else 'w', castling, en_passant,
+                         str(self.halfmove_clock), str(self.fullmove_number)))
+
+    def set_position(self, found, active_colour, castling, en_passant):
+        # Place pieces on an empty board. Used by set_fen and set_packed.
+        #     found -- lists of (piece_class, x, y) for the white and black pieces
+        #     castling -- castling rights. See WHITE_KING_SIDE, etc.
+        #     en_passant -- (x, y) of the square skipped by the last move's pawn double-move, or None
+        for colour in (0, 1):
+            back_rank = 0 if colour else 7
+            king_side, queen_side = (BLACK_KING_SIDE, BLACK_QUEEN_SIDE) if colour else (WHITE_KING_SIDE,
+                                                                                       WHITE_QUEEN_SIDE)
+            free_ids = list(range(16))
+            ids = []
+            # Prefer the IDs used in the starting position: King 12, corner Rooks 8 and 15, Pawns by file.
+            for piece_class, x, y in found[colour]:
+                if piece_class == pieces.King:
+                    piece_id = 12
+                elif piece_class == pieces.Rook and y == back_rank and x in (0, 7):
+                    piece_id = x + 8
+                elif piece_class == pieces.Pawn:
+                    piece_id = x
+                else:
+                    piece_id = None
+                if piece_id in free_ids:
+                    free_ids.remove(piece_id)
+                else:
+                    piece_id = None
+                ids.append(piece_id)
+            if len(found[colour]) > 16 or sum(piece[0] == pieces.King for piece in found[colour]) != 1:
+                raise ValueError("Each player must have one King and at most 16 pieces")
+            if any(piece_class == pieces.Pawn and y in (0, 7) for piece_class, x, y in found[colour]):
+                raise ValueError("Pawns can't stand on the first or last rank")
+
+            for (piece_class, x, y), piece_id in zip(found[colour], ids):
+                if piece_id is None:
+                    piece_id = free_ids.pop(0)
+                piece = self.create_piece_on_board(piece_class, colour, x, y, piece_id)
+                # Castling rights. Pieces which can't castle are treated as having moved.
+                if piece_class == pieces.King:
+                    piece.has_moved = (x, y) != (4, back_rank) or not castling & (king_side | queen_side)
+                elif piece_class == pieces.Rook:
+                    piece.has_moved = y != back_rank or not ((x == 7 and castling & king_side) or
+                                                             (x == 0 and castling & queen_side))
+
+        self.active_colour = active_colour
+
+        if en_passant:
+            # The pawn which just made a double-move belongs to the player who is not moving.
+            x, y = en_passant
+            self.en_passant = y * 8 + x
+            pawn = self.get_en_passant_pawn()
+            if not isinstance(pawn, pieces.Pawn) or pawn.colour == self.active_colour:
+                self.en_passant = None
+                raise ValueError("No pawn can be captured en-passant on " + Move.get_square_name(x, y))
+
+    def pack(self):
+        # Compact copy of the position as bytes, which can be sent to another process cheaply. Load it with
+        # Board(packed=...). Does not include the move history.
+        #     bytes 0 - 63: piece on each square (y * 8 + x). 0 => empty, 1 - 6 => white Pawn, Knight, Bishop, Rook,
+        #                   Queen, King, 7 - 12 => black pieces in the same order
+        #     byte 64: active colour, byte 65: castling rights,
+        #     byte 66: square skipped by the last move's pawn double-move (y * 8 + x), or 64 if none
+        #     byte 67: halfmove clock (at most 255), bytes 68 - 69: fullmove number (little-endian)
+        data = bytearray(PACKED_SIZE)
+        for colour in (0, 1):
+            for piece in self.pieces[colour]:
+                if piece:
+                    data[piece.y * 8 + piece.x] = PACKED_PIECES.index(type(piece)) + 1 + 6 * colour
+        data[64] = self.active_colour
+        data[65] = self.get_castling_rights()
+        data[66] = 64 if self.en_passant is None else self.en_passant
+        data[67] = min(self.halfmove_clock, 255)
+        data[68:70] = min(self.fullmove_number, 65535).to_bytes(2, 'little')
+        return bytes(data)
+
+    def set_packed(self, data):
+        # Place pieces from a position made by pack(), on an empty board.
+        if len(data) != PACKED_SIZE:
+            raise ValueError("Packed position must be %d bytes" % PACKED_SIZE)
+        if data[64] > 1 or data[65] > 15 or max(data[:64]) > 12:
+            raise ValueError("Invalid packed position")
+        found = [], []
+        for square in range(64):
+            code = data[square]
+            if code:
+                found[code > 6].append((PACKED_PIECES[(code - 1) % 6], square % 8, square // 8))
+        en_passant = (data[66] % 8, data[66] // 8) if data[66] < 64 else None
+        self.set_position(found, data[64], data[65], en_passant)
+        self.halfmove_clock = data[67]
+        self.fullmove_number = int.from_bytes(data[68:70], 'little')
+
+    def get_castling_rook(self, colour, king_side):
+        # The Rook a player can still castle with on one side, or None.
+        # Only checks the Rook. The King must also not have moved.
+        rank = 0 if colour else 7
+        rook = self.piece_grid[7 if king_side else 0][rank]
+        if isinstance(rook, pieces.Rook) and rook.colour == colour and not rook.has_moved:
+            return rook
+        return None
+
+    def get_castling_rights(self):
+        # Combination of WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE, BLACK_QUEEN_SIDE.
+        rights = 0
+        for colour, king_side, queen_side in ((0, WHITE_KING_SIDE, WHITE_QUEEN_SIDE),
+                                              (1, BLACK_KING_SIDE, BLACK_QUEEN_SIDE)):
+            if not self.kings[colour].has_moved:
+                if self.get_castling_rook(colour, king_side=True):
+                    rights |= king_side
+                if self.get_castling_rook(colour, king_side=False):
+                    rights |= queen_side
+        return rights
+
+    def get_en_passant_key(self):
+        # Hash key for the en-passant square. Only included if one of the active player's pawns is next to the pawn
+        # which made the double-move, so positions that only differ by an unusable en-passant square match.
+        pawn = self.get_en_passant_pawn()
+        if pawn:
+            for x in (pawn.x - 1, pawn.x + 1):
+                if 0 <= x <= 7:
+                    piece = self.piece_grid[x][pawn.y]
+                    if isinstance(piece, pieces.Pawn) and piece.colour == self.active_colour:
+                        return EN_PASSANT_KEYS[pawn.x]
+        return 0
+
+    def get_zobrist_key(self):
+        # Calculate the hash of the position from scratch.
+        key = 0
+        for colour in (0, 1):
+            for piece in self.pieces[colour]:
+                if piece:
+                    key ^= PIECE_KEYS[type(piece)][colour][piece.y * 8 + piece.x]
+        if self.active_colour:
+            key ^= BLACK_TO_MOVE_KEY
+        return key ^ CASTLING_KEYS[self.get_castling_rights()] ^ self.get_en_passant_key()
+
+    def is_repetition(self, count=3):
+        # Whether the current position has occurred at least count times.
+        return self.position_counts[self.zobrist_key] >= count
+
+    def get_move(self, text):
+        # The legal move for the active player written in coordinate notation (eg: 'e2e4', 'e7e8q').
+        for move in self.get_legal_moves():
+            if str(move) == text:
+                return move
+        raise ValueError("Not a legal move: " + text)
+
+    def parse_san(self, text):
+        # The legal move for the active player written in Standard Algebraic Notation (eg: 'e4', 'Nbd7', 'exd8=Q+',
+        # 'O-O'). Only the pieces which could make the move are searched for valid moves.
+        san = text.rstrip('+#!?')
+        colour = self.active_colour
+        king = self.kings[colour]
+        if san in ('O-O', 'O-O-O', '0-0', '0-0-0'):
+            new_x = 6 if len(san) == 3 else 2
+            if king.x == 4 and (new_x, king.y) in king.get_valid_moves():
+                return Move(king.x, king.y, new_x, king.y)
+            raise ValueError("Not a legal move: " + text)
+
+        promotion = None
+        if len(san) > 2 and san[-1] in 'QRBN' and san[0] in FILES:
+            # Pawn promotion, eg: 'e8=Q' or 'e8Q'
+            promotion = FEN_CHARACTERS[san[-1]][0]
+            san = san[:-2] if san[-2] == '=' else san[:-1]
+        if len(san) < 2 or san[-2] not in FILES or san[-1] not in '12345678':
+            raise ValueError("Invalid move: " + text)
+        new_x, new_y = FILES.index(san[-2]), 8 - int(san[-1])
+
+        if san[0] in FILES:
+            piece_class = pieces.Pawn
+            hint = san[:-2]
+        elif san[0] in 'NBRQK':
+            piece_class = FEN_CHARACTERS[san[0]][0]
+            hint = san[1:-2]
+        else:
+            raise ValueError("Invalid move: " + text)
+        # Disambiguation: the file and/or rank the piece moves from
+        hint = hint.replace('x', '')
+        from_x = FILES.index(hint[0]) if hint and hint[0] in FILES else None
+        from_y = 8 - int(hint[-1]) if hint and hint[-1] in '12345678' else None
+
+        found = None
+        for piece in self.pieces[colour]:
+            if type(piece) is not piece_class or from_x not in (None, piece.x) or from_y not in (None, piece.y):
+                continue
+            if (new_x, new_y) in piece.get_valid_moves():
+                if found:
+                    raise ValueError("Ambiguous move: " + text)
+                found = piece
+        if not found:
+            raise ValueError("Not a legal move: " + text)
+        if (piece_class == pieces.Pawn and new_y in (0, 7)) != (promotion is not None):
+            raise ValueError("Invalid promotion: " + text)
+        return Move(found.x, found.y, new_x, new_y, promotion)
 
     def move(self, piece, x, y):
+        # Move a piece, then end the turn. Raises PawnPromotionError before changing the board if the move promotes a
+        # pawn, so that the user can select the promotion they want. Finish the move with promote().
         pieces.Piece.validate_coord(x)
         pieces.Piece.validate_coord(y)
 
-        # If the piece is a pawn...
-        if isinstance(piece, pieces.Pawn):
-            # ...and is making a double-move, create an en-passant pawn
-            if abs(y - piece.y) > 1:
-                piece_class, colour, file, rank = pieces.EnPassantPawn, piece.colour, piece.x, piece.y + piece.step
-                self.create_piece_on_board(piece_class, colour, file, rank, pawn=piece)
-
-            # ...and is on the second-back rank (so it will be moved to the back rank), promote it.
-            elif (piece.y - 6 * piece.step) % 7 == 0:
-                raise exceptions.PawnPromotionError(piece, x, y)
-
-        # If the piece is a Rook, mark it as having moved
-        if isinstance(piece, pieces.Rook) and not piece.has_moved:
-            piece.has_moved = True
-
-        # If the piece is a King, mark it as having moved. Handle castling
-        if isinstance(piece, pieces.King) and not piece.has_moved:
-            piece.has_moved = True
-            if abs(x - piece.x) > 1:
-                rook_initial_file = 0 if x < piece.x else 7
-                rook_final_file = 3 if x < piece.x else 5
-                rook = self.pieces[piece.colour][rook_initial_file + 8]
-                self.move(rook, rook_final_file, y)
-
-        captured_piece = self.piece_grid[x][y]
-        if captured_piece:
-            self.capture(captured_piece, piece)
+        # If the piece is a pawn on the second-back rank (so it will be moved to the back rank), promote it.
+        if isinstance(piece, pieces.Pawn) and (piece.y - 6 * piece.step) % 7 == 0:
+            raise exceptions.PawnPromotionError(piece, x, y)
 
-        self.piece_grid[piece.x][piece.y] = None
-        self.piece_grid[x][y] = piece
-        piece.x, piece.y = x, y
-        piece.sprite.rect.x, piece.sprite.rect.y = self.get_pixel_coords(x, y)
+        self.make_move(Move(piece.x, piece.y, x, y))
 
     def promote(self, pawn_promotion, promotion_piece):
         pawn, x, y = pawn_promotion.properties
-        possible_promotions = pieces.Queen, pieces.Rook, pieces.Bishop, pieces.Knight
-        assert promotion_piece in possible_promotions
-
-        captured_piece = self.piece_grid[x][y]
+        assert promotion_piece in self.possible_promotions
+        self.make_move(Move(pawn.x, pawn.y, x, y, promotion_piece))
+
+    def make_move(self, move):
+        # Play a move for the piece on (move.x, move.y), including castling, en-passant and promotion, then end the
+        # turn. The move is not checked for legality. Undo it with unmake_move().
+        #
+        # Each move adds an undo record to self.undo_stack:
+        #     (move, piece, captured_piece, en_passant, has_moved, rook, halfmove_clock)
+        # en_passant and halfmove_clock are the values before the move, and has_moved is the moved King or Rook's flag
+        # before the move.
+        grid = self.piece_grid
+        x, y = move.new_x, move.new_y
+        piece = grid[move.x][move.y]
+        colour = piece.colour
+        en_passant = self.en_passant
+        has_moved = getattr(piece, 'has_moved', None)
+
+        # Remove the castling rights and en-passant square from the hash. They are added back after the move.
+        self.key_history.append(self.zobrist_key)
+        key = self.zobrist_key ^ CASTLING_KEYS[self.get_castling_rights()] ^ self.get_en_passant_key()
+        piece_keys = PIECE_KEYS[type(piece)][colour]
+        key ^= piece_keys[move.y * 8 + move.x]
+
+        # Captures
+        captured_piece = grid[x][y]
+        if isinstance(piece, pieces.Pawn) and y * 8 + x == en_passant:
+            # En-passant. The captured pawn is not on the target square.
+            captured_piece = self.get_en_passant_pawn()
+            grid[captured_piece.x][captured_piece.y] = None
         if captured_piece:
-            self.capture(captured_piece, pawn)
+            self.pieces[captured_piece.colour][captured_piece.id] = None
+            key ^= PIECE_KEYS[type(captured_piece)][captured_piece.colour][captured_piece.y * 8 + captured_piece.x]
 
-        # Remove old pawn
-        self.piece_grid[pawn.x][pawn.y] = None
-        # Don't need to kill sprite, as it was already done when the pawn was picked up
+        # Move the piece
+        grid[move.x][move.y] = None
+        grid[x][y] = piece
+        piece.x, piece.y = x, y
+        if has_moved is False:
+            piece.has_moved = True
 
-        # Create new piece, replace position of old pawn in self.pieces
-        self.create_piece_on_board(promotion_piece, pawn.colour, x, y, pawn.id)
+        # Castling. Move the Rook too.
+        rook = None
+        if isinstance(piece, pieces.King) and abs(x - move.x) > 1:
+            rook_initial_file = 0 if x < move.x else 7
+            rook_final_file = 3 if x < move.x else 5
+            rook = grid[rook_initial_file][y]
+            grid[rook_initial_file][y] = None
+            grid[rook_final_file][y] = rook
+            rook.x = rook_final_file
+            rook.has_moved = True
+            rook_keys = PIECE_KEYS[pieces.Rook][colour]
+            key ^= rook_keys[y * 8 + rook_initial_file] ^ rook_keys[y * 8 + rook_final_file]
+
+        new_en_passant = None
+        if isinstance(piece, pieces.Pawn) and move.promotion:
+            # Replace the pawn with the new piece. The new piece takes the pawn's ID.
+            self.create_piece_on_board(move.promotion, colour, x, y, piece.id)
+            key ^= PIECE_KEYS[move.promotion][colour][y * 8 + x]
+        else:
+            key ^= piece_keys[y * 8 + x]
+            if isinstance(piece, pieces.Pawn) and abs(y - move.y) > 1:
+                # Double-move. The opponent may capture on the skipped square next turn.
+                new_en_passant = (move.y + piece.step) * 8 + x
+
+        # Move clocks
+        halfmove_clock = self.halfmove_clock
+        self.halfmove_clock = 0 if captured_piece or isinstance(piece, pieces.Pawn) else halfmove_clock + 1
+        if colour:
+            self.fullmove_number += 1
+
+        self.end_turn()
+        self.en_passant = new_en_passant
+        self.check_info = [None, None]
+        self.legal_moves = None
+
+        key ^= BLACK_TO_MOVE_KEY ^ CASTLING_KEYS[self.get_castling_rights()] ^ self.get_en_passant_key()
+        self.zobrist_key = key
+        self.position_counts[key] = self.position_counts.get(key, 0) + 1
+
+        self.attack_history.append(self.update_attacks(move, piece, captured_piece, rook)
+                                   if self.piece_attacks is not None else None)
+
+        self.undo_stack.append((move, piece, captured_piece, en_passant, has_moved, rook, halfmove_clock))
+
+    def unmake_move(self):
+        # Undo the last move played with make_move(), restoring the board exactly.
+        move, piece, captured_piece, self.en_passant, has_moved, rook, self.halfmove_clock = self.undo_stack.pop()
+        grid = self.piece_grid
+
+        count = self.position_counts[self.zobrist_key]
+        if count > 1:
+            self.position_counts[self.zobrist_key] = count - 1
+        else:
+            del self.position_counts[self.zobrist_key]
+        self.zobrist_key = self.key_history.pop()
+        x, y = move.new_x, move.new_y
+        colour = piece.colour
+        if colour:
+            self.fullmove_number -= 1
+        self.active_colour = colour
+
+        # Replace a promoted piece with the original pawn
+        if move.promotion:
+            self.pieces[colour][piece.id] = piece
+
+        # Castling. Move the Rook back.
+        if rook:
+            rook_initial_file = 0 if x < move.x else 7
+            grid[rook.x][y] = None
+            grid[rook_initial_file][y] = rook
+            rook.x = rook_initial_file
+            rook.has_moved = False
+
+        # Move the piece back
+        grid[x][y] = None
+        grid[move.x][move.y] = piece
+        piece.x, piece.y = move.x, move.y
+        if has_moved is not None:
+            piece.has_moved = has_moved
+
+        # Put back the captured piece. It is still on its square, which is not the target square for en-passant.
+        if captured_piece:
+            self.pieces[captured_piece.colour][captured_piece.id] = captured_piece
+            grid[captured_piece.x][captured_piece.y] = captured_piece
+        self.check_info = [None, None]
+        self.legal_moves = None
+
+        attack_changes = self.attack_history.pop()
+        if self.piece_attacks is not None:
+            if attack_changes is None:
+                # The maps were built after this move was played. They are built again when next needed.
+                self.piece_attacks = self.attack_counts = self.ranged_attackers = None
+            else:
+                for changed_piece, squares in attack_changes:
+                    self.remove_piece_attacks(changed_piece)
+                    if squares is not None:
+                        self.add_piece_attacks(changed_piece, squares)
+
+    def clear_caches(self):
+        # Forget everything worked out from the position which is kept to be reused: legal moves, check info, attack
+        # maps and the pieces' move lists. Saves memory while the board isn't in use, eg: a game waiting for its next
+        # move. Everything is worked out again when next needed.
+        self.check_info = [None, None]
+        self.legal_moves = None
+        self.piece_attacks = self.attack_counts = self.ranged_attackers = None
+        self.attack_history = [None] * len(self.attack_history)
+        for colour_pieces in self.pieces:
+            for piece in colour_pieces:
+                if piece:
+                    piece.valid_moves.clear()
+                    piece.protected_squares.clear()
+
+    def get_legal_moves(self, colour=None):
+        # All legal moves for a player (default: the player whose turn it is), as a list of Move tuples.
+        # Pawn moves to the back rank are expanded into one move per possible promotion.
+        # The moves for the active player are worked out once per position, and kept until the board changes.
+        if colour is None:
+            colour = self.active_colour
+        if colour == self.active_colour:
+            if self.legal_moves is None:
+                self.legal_moves = self.find_legal_moves(colour)
+            return list(self.legal_moves)
+        return self.find_legal_moves(colour)
+
+    def get_piece_moves(self, piece):
+        # Squares a piece can legally move to, as a list of (x, y). Uses the moves cached by get_legal_moves.
+        return [(move.new_x, move.new_y) for move in self.get_legal_moves(piece.colour)
+                if move.x == piece.x and move.y == piece.y and move.promotion in (None, self.possible_promotions[0])]
+
+    def find_legal_moves(self, colour):
+        moves = []
+        for piece in self.pieces[colour]:
+            if not piece:
+                continue
+            promoting = isinstance(piece, pieces.Pawn) and (piece.y - 6 * piece.step) % 7 == 0
+            for new_x, new_y in piece.get_valid_moves():
+                if promoting:
+                    for promotion in self.possible_promotions:
+                        moves.append(Move(piece.x, piece.y, new_x, new_y, promotion))
+                else:
+                    moves.append(Move(piece.x, piece.y, new_x, new_y))
+        return moves
 
     def is_check(self, colour):
         # This is used internally when checking valid moves so they do not leave the King in check.
-        king = self.pieces[colour][12]
+        king = self.kings[colour]
         return king.is_checked()
 
+    def find_attacked_squares(self, piece):
+        # Squares (y * 8 + x) attacked by a piece, whether they are empty or hold a piece of either colour.
+        # As for Piece.get_protected_squares, the opponent's King doesn't block the lines of ranged pieces, so the King
+        # can't stay in check by moving away along the line.
+        x, y = piece.x, piece.y
+        piece_class = type(piece)
+        if piece_class is pieces.Pawn:
+            new_y = y + piece.step
+            if not 0 <= new_y <= 7:
+                return []
+            return [new_y * 8 + new_x for new_x in (x - 1, x + 1) if 0 <= new_x <= 7]
+        if piece_class is pieces.Knight:
+            return KNIGHT_ATTACKS[y * 8 + x]
+        if piece_class is pieces.King:
+            return KING_ATTACKS[y * 8 + x]
+
+        grid = self.piece_grid
+        opponent_king = self.kings[not piece.colour]
+        squares = []
+        for delta_x, delta_y in RANGED_DIRECTIONS[piece_class]:
+            new_x, new_y = x + delta_x, y + delta_y
+            while 0 <= new_x <= 7 and 0 <= new_y <= 7:
+                squares.append(new_y * 8 + new_x)
+                blocker = grid[new_x][new_y]
+                if blocker is not None and blocker is not opponent_king:
+                    break
+                new_x, new_y = new_x + delta_x, new_y + delta_y
+        return squares
+
+    def get_attack_counts(self):
+        # Number of pieces of each colour attacking each square: (white counts, black counts), each a list indexed by
+        # y * 8 + x. Built from every piece the first time it is needed, then updated move by move.
+        if self.attack_counts is None:
+            self.piece_attacks = {}
+            self.attack_counts = [0] * 64, [0] * 64
+            self.ranged_attackers = [set() for _ in range(64)]
+            for colour_pieces in self.pieces:
+                for piece in colour_pieces:
+                    if piece:
+                        self.add_piece_attacks(piece, self.find_attacked_squares(piece))
+        return self.attack_counts
+
+    def add_piece_attacks(self, piece, squares):
+        self.piece_attacks[piece] = squares
+        counts = self.attack_counts[piece.colour]
+        for square in squares:
+            counts[square] += 1
+        if type(piece) in RANGED_DIRECTIONS:
+            ranged_attackers = self.ranged_attackers
+            for square in squares:
+                ranged_attackers[square].add(piece)
+
+    def remove_piece_attacks(self, piece):
+        # Take a piece out of the attack maps. Returns the squares it attacked, or None if it wasn't in them.
+        squares = self.piece_attacks.pop(piece, None)
+        if squares is not None:
+            counts = self.attack_counts[piece.colour]
+            for square in squares:
+                counts[square] -= 1
+            if type(piece) in RANGED_DIRECTIONS:
+                ranged_attackers = self.ranged_attackers
+                for square in squares:
+                    ranged_attackers[square].discard(piece)
+        return squares
+
+    def update_attacks(self, move, piece, captured_piece, rook):
+        # Update the attack maps for a move which was just played. Only the pieces involved in the move, and the ranged
+        # pieces attacking a square the move changed (whose lines may now be blocked or opened), are looked at again.
+        # Returns the changes, as stored in attack_history.
+        changed_squares = [move.y * 8 + move.x, move.new_y * 8 + move.new_x]
+        # After a promotion, the new piece has the pawn's ID
+        changed_pieces = {piece, self.pieces[piece.colour][piece.id]}
+        if captured_piece:
+            changed_squares.append(captured_piece.y * 8 + captured_piece.x)
+            changed_pieces.add(captured_piece)
+        if rook:
+            rank = move.new_y * 8
+            king_side = move.new_x > move.x
+            changed_squares += [rank + (7 if king_side else 0), rank + (5 if king_side else 3)]
+            changed_pieces.add(rook)
+        ranged_attackers = self.ranged_attackers
+        for square in changed_squares:
+            changed_pieces.update(ranged_attackers[square])
+
+        changes = []
+        for changed_piece in changed_pieces:
+            squares = self.remove_piece_attacks(changed_piece)
+            if self.pieces[changed_piece.colour][changed_piece.id] is changed_piece:
+                self.add_piece_attacks(changed_piece, self.find_attacked_squares(changed_piece))
+            changes.append((changed_piece, squares))
+        return changes
+
+    def is_square_attacked(self, x, y, by_colour):
+        # Whether any piece of by_colour attacks the square (x, y). Looked up in the attack maps, so the King of the
+        # other colour doesn't block lines to the squares behind it. See find_attacked_squares.
+        return self.get_attack_counts()[by_colour][y * 8 + x] > 0
+
+    def get_mobility(self, colour):
+        # Number of squares attacked by at least one piece of the colour.
+        return 64 - self.get_attack_counts()[colour].count(0)
+
+    def get_check_info(self, colour):
+        # Find the pieces checking the King of the given colour, and the pieces pinned to it, by probing outwards from
+        # the King once. Returns (checkers, block_squares, pins):
+        #     checkers -- opponent pieces attacking the King.
+        #     block_squares -- squares a piece other than the King can move to in order to capture or block a single
+        #                      checking piece.
+        #     pins -- {pinned piece: squares it can move to without leaving the King in check}
+        if self.check_info[colour] is not None:
+            return self.check_info[colour]
+
+        grid = self.piece_grid
+        king = self.kings[colour]
+        checkers = []
+        block_squares = set()
+        pins = {}
+
+        # Ranged pieces
+        for directions, piece_classes in ((pieces.ROOK_DIRECTIONS, (pieces.Rook, pieces.Queen)),
+                                          (pieces.BISHOP_DIRECTIONS, (pieces.Bishop, pieces.Queen))):
+            for delta_x, delta_y in directions:
+                path = []
+                own_piece = None  # First piece of the King's colour on the path. May be pinned.
+                x, y = king.x + delta_x, king.y + delta_y
+                while 0 <= x <= 7 and 0 <= y <= 7:
+                    path.append((x, y))
+                    piece = grid[x][y]
+                    if piece is not None:
+                        if piece.colour == colour:
+                            if own_piece:
+                                break  # Two pieces of the King's colour. Nothing on this path can be pinned.
+                            own_piece = piece
+                        else:
+                            if isinstance(piece, piece_classes):
+                                if own_piece:
+                                    pins[own_piece] = set(path)
+                                else:
+                                    checkers.append(piece)
+                                    block_squares.update(path)
+                            break
+                    x, y = x + delta_x, y + delta_y
+
+        # Knights
+        for delta_x, delta_y in pieces.KNIGHT_DELTAS:
+            x, y = king.x + delta_x, king.y + delta_y
+            if 0 <= x <= 7 and 0 <= y <= 7:
+                piece = grid[x][y]
+                if isinstance(piece, pieces.Knight) and piece.colour != colour:
+                    checkers.append(piece)
+                    block_squares.add((x, y))
+
+        # Pawns. Opponent pawns attack the King from the rank in front of it.
+        y = king.y + (1 if colour else -1)
+        if 0 <= y <= 7:
+            for x in (king.x - 1, king.x + 1):
+                if 0 <= x <= 7:
+                    piece = grid[x][y]
+                    if isinstance(piece, pieces.Pawn) and piece.colour != colour:
+                        checkers.append(piece)
+                        block_squares.add((x, y))
+
+        self.check_info[colour] = checkers, block_squares, pins
+        return self.check_info[colour]
+
+    def is_legal_move(self, piece, x, y):
+        # Whether moving a piece other than the King to (x, y) leaves its King safe. The target square must already be
+        # a possible move for the piece.
+        checkers, block_squares, pins = self.get_check_info(piece.colour)
+        if isinstance(piece, pieces.Pawn) and y * 8 + x == self.en_passant:
+            # En-passant captures remove a pawn which is not on the target square. This can check the King in ways
+            # a pin can't describe, so test the move directly.
+            return not self.is_check_after_move(piece, x, y)
+        if len(checkers) > 1:
+            return False  # Only the King can move out of a double check
+        if checkers and (x, y) not in block_squares:
+            return False
+        if piece in pins and (x, y) not in pins[piece]:
+            return False
+        return True
+
     def is_check_or_checkmate(self, colour):
         # This may be used when running the game.
-        check = self.is_check(colour)
-        if all(not piece.get_valid_moves() for piece in self.pieces[colour] if piece):
+        check = bool(self.get_check_info(colour)[0])
+        if not self.get_legal_moves(colour):
             # No moves left
             if check:
                 raise exceptions.CheckmateError(colour)
             else:
                 raise exceptions.StalemateError(colour, 'no moves')
+        if self.halfmove_clock >= 100:
+            raise exceptions.StalemateError(colour, 'no progress')
+        if self.is_repetition():
+            raise exceptions.StalemateError(colour, 'repeated moves')
         return check
 
     def is_check_after_move(self, piece, x, y):
         pieces.Piece.validate_coord(x)
         pieces.Piece.validate_coord(y)
 
-        # Move piece on board, but so that it isn't visible to player
-        captured_piece = self.piece_grid[x][y]
-        if captured_piece and not isinstance(captured_piece, pieces.EnPassantPawn):
-            self.pieces[captured_piece.colour][captured_piece.id] = None
-        self.piece_grid[piece.x][piece.y] = None
-        self.piece_grid[x][y] = piece
-        old_coords = piece.coords
-        piece.x, piece.y = x, y
-
+        # Play the move on the board, but so that it isn't visible to player
+        self.make_move(Move(piece.x, piece.y, x, y))
         # Would the move result in a check?
         check = self.is_check(piece.colour)
-
         # Move everything back
-        piece.x, piece.y = old_coords
-        self.piece_grid[piece.x][piece.y] = piece
-        if captured_piece:
-            if not isinstance(captured_piece, pieces.EnPassantPawn):
-                self.pieces[captured_piece.colour][captured_piece.id] = captured_piece
-            self.piece_grid[x][y] = captured_piece
-        else:
-            self.piece_grid[x][y] = None
+        self.unmake_move()
         return check
-
-    def draw_board(self, surface):
-        surface.blit(self.tiles, (self.x_offset, self.y_offset))
-        surface.blit(self.labels_white, (self.x_offset, self.y_offset))
-
-    def draw_pieces(self, surface):
-        self.piece_sprites[0].draw(surface)
-        self.piece_sprites[1].draw(surface)
@@ -1,24 +1,96 @@
+import argparse
+import random
+import time
+
 import pygame
-import exceptions
-from board import Board
-import pieces
+from book import OpeningBook
+from engine import EngineWorker, MATE, MAX_PLY
+from game import Game
+import graphics
+from graphics import GraphicalBoard
 
 
 # Global parameters
 BLACK = 0, 0, 0
+WHITE = 255, 255, 255
 SCREEN = 900, 700
 FPS = 60
+# How often to check for results while the engine is searching, in milliseconds.
+ENGINE_POLL_INTERVAL = 20
+ANALYSIS_FONT_SIZE = 24
+
+
+class Chess(Game):
+    # A Game played with the mouse, drawn with pygame.
 
+    def __init__(self, computer_colour=None, think_time=2.0, analysis=False, book=None):
+        # computer_colour -- colour played by the computer (0 => white, 1 => black), or None for two players.
+        # think_time -- seconds the computer searches for each move.
+        # analysis -- show the engine's evaluation of the position below the board. Toggled with the A key.
+        # book -- book.OpeningBook the computer plays from, without searching, while the position is in it. It is
+        #         closed with the game.
+        super().__init__(GraphicalBoard())
+        self.computer_colour = computer_colour
+        self.think_time = think_time
+        self.analysis = analysis
+        self.book = book
+        # Book moves are chosen at random, in proportion to their weights, so the computer doesn't always play the
+        # same opening.
+        self.book_random = random.Random()
+        # Zobrist key of the last position looked up in the book
+        self.book_key = None
+        # The engine searches in another process, so the game keeps responding while it thinks. It is started when
+        # first needed. See update_engine.
+        self.engine_worker = None
+        # Latest engine result for the position on the board, and the lines of text showing it.
+        self.analysis_result = None
+        self.analysis_images = None
 
-class Chess:
-    def __init__(self):
-        self.board = Board()
-        self.active_colour = 0  # 0 => white, 1 => black
         self.held_piece = None
-        self.check_flag = False
-        self.pawn_promotion = None
+        # Squares the held piece can move to
+        self.held_moves = []
+
+        # Where the held piece is drawn, following the mouse.
+        self.drag_rect = None
+        # Screen areas which need to be drawn again, other than those changed by the board. See get_dirty_rects.
+        self.dirty_rects = []
+        # The board, overlays and pieces, apart from the held piece, drawn onto one surface. Drawn again only after
+        # one of them changes. See get_background.
+        self.background = None
+
+    def mark_tiles_dirty(self, squares):
+        self.dirty_rects.extend(self.board.get_tile_rect(x, y) for x, y in squares)
+        self.background = None
+
+    def mark_held_piece_dirty(self):
+        # Tiles highlighted while a piece is held, and the piece following the mouse.
+        self.mark_tiles_dirty(self.held_moves + [self.held_piece.coords])
+        self.dirty_rects.append(self.drag_rect.copy())
+
+    def move_drag_rect(self, pos):
+        tile_size = self.board.tile_size
+        self.dirty_rects.append(self.drag_rect.copy())
+        self.drag_rect.topleft = pos[0] - tile_size // 2, pos[1] - tile_size // 2
+        self.dirty_rects.append(self.drag_rect.copy())
+
+    def get_promotion_rect(self):
+        # Area covered by the pawn promotion overlay.
+        promotion = self.pawn_promotion
+        tile_size = self.board.tile_size
+        return pygame.Rect(self.board.get_pixel_coords(promotion.x, 4 if promotion.pawn.colour else 0),
+                           (tile_size, 4 * tile_size))
+
+    def get_dirty_rects(self):
+        # Screen areas which have changed since the last call, and need to be drawn again.
+        if self.board.dirty_rects:
+            self.background = None
+        rects = self.dirty_rects + self.board.dirty_rects
+        self.dirty_rects = []
+        self.board.dirty_rects = []
+        return rects
 
     def pick_up_piece(self, x, y):
+        pos = x, y
         try:
             x, y = self.board.get_board_coords(x, y)
         except ValueError:
@@ -26,21 +98,26 @@ class Chess:
             pass
         else:
             piece = self.board.piece_grid[x][y]
-            if piece and piece.colour == self.active_colour:  # Player can only move their own pieces
+            # Player can only move their own pieces, and only on their own turn
+            if piece and piece.colour == self.active_colour and self.active_colour != self.computer_colour:
                 self.held_piece = piece
-                piece.sprite.kill()  # Remove sprite from groups so is not drawn with other pieces
-                piece.get_valid_moves()
+                self.board.sprites[piece].kill()  # Remove sprite from groups so is not drawn with other pieces
+                self.held_moves = self.board.get_piece_moves(piece)
+                self.drag_rect = self.board.sprites[piece].rect.copy()
+                self.move_drag_rect(pos)
+                self.mark_held_piece_dirty()
 
     def turnover_move(self):
-        self.active_colour = not self.active_colour  # Switch players
-        if self.board.en_passant_pawns[self.active_colour] is not None:
-            self.board.remove_expired_en_passant_pawn(self.active_colour)
-        try:
-            self.check_flag = self.board.is_check_or_checkmate(self.active_colour)
-        except exceptions.GameOverError as e:
-            print(e.message)
+        # The board has already switched players.
+        self.board.update_sprites()
+        # The check overlay may move from one King to the other.
+        self.mark_tiles_dirty(king.coords for king in self.board.kings)
+        super().turnover_move()
+        if self.game_over:
+            print(self.game_over.message)
 
     def release_piece(self, x, y):
+        self.mark_held_piece_dirty()
         try:
             x, y = self.board.get_board_coords(x, y)
         except ValueError:
@@ -48,49 +125,166 @@ class Chess:
             pass
         else:
             if self.held_piece.x != x or self.held_piece.y != y:  # Avoid unnecessary work for trivial case
-                if (x, y) in self.held_piece.valid_moves:
-                    try:
-                        self.board.move(self.held_piece, x, y)
-                    except exceptions.PawnPromotionError as e:
-                        self.pawn_promotion = e
+                if (x, y) in self.held_moves:
+                    if not self.move_piece(self.held_piece, x, y):
+                        # Pawn promotion
+                        self.dirty_rects.append(self.get_promotion_rect())
                         self.held_piece = None
+                        self.held_moves = []
+                        self.drag_rect = None
                         # Must drop the piece here
-                        # Only restore the sprite and clear the valid moves if the promotion is cancelled.
+                        # Only restore the sprite if the promotion is cancelled.
                         return
-                    else:
-                        self.turnover_move()
 
         self.board.add_piece_sprite(self.held_piece)  # Add to group of sprites to draw
-        self.held_piece.valid_moves.clear()
+        self.held_moves = []
         self.held_piece = None  # Drop piece
+        self.drag_rect = None
 
     def select_promotion(self, x, y):
         promotion = self.pawn_promotion
-        self.pawn_promotion = None
+        self.dirty_rects.append(self.get_promotion_rect())
         try:
             x, y = self.board.get_board_coords(x, y)
             if x != promotion.x or ((y > 3) ^ promotion.pawn.colour):
                 raise ValueError
         except ValueError:
             # Clicked outside of promotion selection area. Cancel promotion, restore old pawn.
+            self.cancel_promotion()
             self.board.add_piece_sprite(promotion.pawn)  # Add to group of sprites to draw
-            promotion.pawn.valid_moves.clear()
+            self.mark_tiles_dirty([promotion.pawn.coords])
             return
 
         # Selected a piece to promote to.
         piece_index = y if y < 4 else 7 - y
-        possible_promotions = pieces.Queen, pieces.Rook, pieces.Bishop, pieces.Knight
-        promotion_piece = possible_promotions[piece_index]
+        promotion_piece = self.board.possible_promotions[piece_index]
 
         # Promote piece, end move.
-        self.board.promote(promotion, promotion_piece)
-        self.turnover_move()
+        self.promote(promotion_piece)
+
+    @property
+    def computer_thinking(self):
+        return self.active_colour == self.computer_colour and not self.game_over
+
+    @property
+    def engine_busy(self):
+        return self.engine_worker is not None and self.engine_worker.busy
+
+    def update_engine(self):
+        # Keep the engine searching the position on the board while the computer is to move, or while analysis is on.
+        # Collects the results so far, and plays the computer's move once its search is done. Never waits for the
+        # search. A search for a position which is no longer on the board, or no longer wanted, is stopped.
+        if self.book and self.computer_thinking and self.book_key != self.board.zobrist_key:
+            self.book_key = self.board.zobrist_key
+            move = self.book.choose_move(self.board, self.book_random)
+            if move:
+                self.make_move(move)
+
+        wanted = self.computer_thinking or (self.analysis and not self.game_over)
+        worker = self.engine_worker
+        if not wanted:
+            if worker and worker.position_key is not None:
+                worker.cancel()
+                self.set_analysis_result(None)
+            return
+        if worker is None:
+            worker = self.engine_worker = EngineWorker()
+
+        if worker.position_key == self.board.zobrist_key:
+            if worker.poll():
+                self.set_analysis_result(worker.best)
+            if worker.done and self.computer_thinking and worker.best:
+                self.make_move(worker.best.move)
+                if not (self.computer_thinking or self.analysis) or self.game_over:
+                    worker.cancel()
+                    self.set_analysis_result(None)
+                    return
+
+        if worker.position_key != self.board.zobrist_key:
+            # New position. When the move played was the one the engine expected, the search carries on from its last
+            # result. See EngineWorker.start_search.
+            worker.start_search(self.board, self.think_time if self.computer_thinking else None)
+            self.set_analysis_result(worker.best)
+
+        if worker.failed:
+            self.stop_engine()
 
-    def process_events(self):
-        for event in pygame.event.get():
+    def stop_engine(self):
+        # The engine's process kept dying (see EngineWorker). Carry on as a game between two players, without analysis.
+        print("The engine has stopped working. The computer player and analysis are switched off.")
+        self.engine_worker.close()
+        self.engine_worker = None
+        self.computer_colour = None
+        self.set_analysis_result(None)
+        if self.analysis:
+            self.toggle_analysis()
+
+    def set_analysis_result(self, result):
+        if result is not self.analysis_result:
+            self.analysis_result = result
+            self.analysis_images = None
+            if self.analysis:
+                self.dirty_rects.append(self.get_analysis_rect())
+
+    def toggle_analysis(self):
+        self.analysis = not self.analysis
+        self.analysis_images = None
+        self.dirty_rects.append(self.get_analysis_rect())
+
+    def get_analysis_rect(self):
+        # Area below the board where the analysis is shown
+        left, top = self.board.get_pixel_coords(0, 8)
+        return pygame.Rect(left, top, 8 * self.board.tile_size, SCREEN[1] - top)
+
+    def get_analysis_text(self):
+        result = self.analysis_result
+        if result is None:
+            return ["Analysing..." if self.engine_busy else "No analysis"]
+        # Scores are shown from white's side
+        score = -result.score if self.active_colour else result.score
+        if abs(score) > MATE - MAX_PLY:
+            moves_to_mate = (MATE - abs(score) + 1) // 2
+            score_text = "%s mates in %d" % ("White" if score > 0 else "Black", moves_to_mate)
+        else:
+            score_text = "%+.2f" % (score / 100)
+        return ["Depth %d    Score %s    %.0f nodes/s" % (result.depth, score_text, result.nodes_per_second),
+                ' '.join(str(move) for move in result.principal_variation)]
+
+    def draw_analysis(self, surface):
+        if self.analysis_images is None:
+            font = graphics.assets.get_font(ANALYSIS_FONT_SIZE)
+            self.analysis_images = [font.render(line, True, WHITE) for line in self.get_analysis_text()]
+        rect = self.get_analysis_rect()
+        surface.fill(BLACK, rect)
+        clip = surface.get_clip()
+        surface.set_clip(rect.clip(clip) if clip else rect)  # Long lines are cut off at the edge of the area
+        for i, image in enumerate(self.analysis_images):
+            surface.blit(image, (rect.left, rect.top + 10 + i * ANALYSIS_FONT_SIZE))
+        surface.set_clip(clip)
+
+    def close(self):
+        if self.engine_worker:
+            self.engine_worker.close()
+        if self.book:
+            self.book.close()
+
+    def process_events(self, events=None):
+        # Handle events (default: all waiting events). Returns True if the game was closed.
+        if events is None:
+            events = pygame.event.get()
+        for event in events:
             if event.type == pygame.QUIT:
                 return True
 
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_a:
+                    self.toggle_analysis()
+
+            elif event.type == pygame.MOUSEMOTION:
+                # Dragging a held piece
+                if self.held_piece:
+                    self.move_drag_rect(event.pos)
+
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == pygame.BUTTON_LEFT:
                     # Pawn promotion
@@ -106,25 +300,33 @@ class Chess:
                     if self.held_piece:
                         self.release_piece(*event.pos)
 
-    def draw_game(self, screen):
-        self.board.draw_board(screen)
+    def get_background(self, screen):
+        # Everything which only changes when a piece is picked up or moved.
+        if self.background is None:
+            self.background = pygame.Surface(screen.get_size()).convert()
+            self.draw_background(self.background)
+        return self.background
+
+    def draw_background(self, surface):
+        surface.fill(BLACK)
+        self.board.draw_board(surface)
         # Tile overlays
         if self.held_piece:
-            for (x, y) in self.held_piece.valid_moves:
+            for (x, y) in self.held_moves:
                 pos = self.board.get_pixel_coords(x, y)
-                screen.blit(self.board.moves_overlay, pos)
-            screen.blit(self.board.moves_overlay, self.held_piece.sprite.rect)
-            screen.blit(self.board.moves_overlay, self.held_piece.sprite.rect)
+                surface.blit(self.board.moves_overlay, pos)
+            held_sprite = self.board.sprites[self.held_piece]
+            surface.blit(self.board.moves_overlay, held_sprite.rect)
         if self.check_flag:
-            active_king = self.board.pieces[self.active_colour][12]
-            screen.blit(self.board.check_overlay, active_king.sprite.rect)
-        # Pieces
-        self.board.draw_pieces(screen)
+            active_king = self.board.kings[self.active_colour]
+            surface.blit(self.board.check_overlay, self.board.sprites[active_king].rect)
+        # Pieces, apart from the held piece
+        self.board.draw_pieces(surface)
+
+    def draw_game(self, screen):
+        screen.blit(self.get_background(screen), (0, 0))
         if self.held_piece:
-            tile_size = self.board.tile_size
-            pos = pygame.mouse.get_pos()
-            pos = pos[0] - tile_size // 2, pos[1] - tile_size // 2
-            screen.blit(self.held_piece.sprite.image, pos)
+            screen.blit(self.board.sprites[self.held_piece].image, self.drag_rect)
         # Pawn promotion overlay
         if self.pawn_promotion:
             if self.pawn_promotion.pawn.colour:
@@ -134,43 +336,113 @@ class Chess:
                 pos = self.board.get_pixel_coords(self.pawn_promotion.x, 0)
                 image = self.board.pawn_promotions_white
             screen.blit(image, pos)
+        if self.analysis:
+            self.draw_analysis(screen)
+
+    def draw_frame(self, screen, rects=None):
+        # Draw the parts of the screen in rects, or the whole screen. Everything else on the screen is left as it is.
+        if rects is None:
+            rects = [screen.get_rect()]
+        for rect in rects:
+            screen.set_clip(rect)
+            self.draw_game(screen)
+        screen.set_clip(None)
 
-    def draw_frame(self, screen):
-        # Background
-        screen.fill(BLACK)
-        self.draw_game(screen)
 
+def play_chess(preload=True, show_startup_times=False, show_frame_stats=False, computer_colour=None, think_time=2.0,
+               analysis=False, book_path=None):
+    # preload -- load every image before the first frame, rather than when first drawn.
+    # show_startup_times -- print the time taken by each step until the first frame is on screen.
+    # show_frame_stats -- print the number of frames drawn, the time taken to draw them and the CPU usage on exit.
+    # computer_colour, think_time, analysis -- see Chess.
+    # book_path -- Polyglot opening book for the computer to play from.
+    start = time.perf_counter()
+    startup_times = []
+
+    def mark(step):
+        startup_times.append((step, time.perf_counter() - start))
 
-def play_chess():
     # Initialise, create display, initialise clock
     pygame.init()
+    mark("pygame.init")
 
     screen = pygame.display.set_mode(SCREEN)
     pygame.display.set_caption("Chess")
+    mark("display")
 
     clock = pygame.time.Clock()
 
+    if preload:
+        graphics.assets.preload()
+        mark("preload assets")
+
     # Program initialisation, first frame logic
-    game = Chess()
+    game = Chess(computer_colour, think_time, analysis, OpeningBook(book_path) if book_path else None)
+    mark("board")
     game.draw_frame(screen)
+    game.get_dirty_rects()
     pygame.display.flip()
+    mark("first frame")
+
+    if show_startup_times:
+        previous = 0.0
+        for step, seconds in startup_times:
+            print("%-16s %7.1f ms" % (step, 1000 * (seconds - previous)))
+            previous = seconds
+        print("%-16s %7.1f ms (%d images loaded in %.1f ms)" % ("total", 1000 * previous, graphics.assets.loads,
+                                                               1000 * graphics.assets.load_seconds))
 
     # Program loop
+    # Nothing is drawn until something changes, so the program sleeps while waiting for events. While the engine is
+    # searching, it wakes up regularly to check for results.
+    loop_start, cpu_start = time.perf_counter(), time.process_time()
+    frames, frame_seconds, max_frame_seconds = 0, 0.0, 0.0
     done = False
+    game.update_engine()  # Starts the search if the computer moves first, or analysis is on
     while not done:
-        # Game logic
-        done = game.process_events()
+        # Game logic. Wait for an event, then handle it and any others which arrived with it.
+        event = pygame.event.wait(ENGINE_POLL_INTERVAL) if game.engine_busy else pygame.event.wait()
+        done = game.process_events([event] + pygame.event.get())
+        game.update_engine()
+
+        # Draw game elements which have changed
+        rects = game.get_dirty_rects()
+        if rects and not done:
+            frame_start = time.perf_counter()
+            game.draw_frame(screen, rects)
 
-        # Draw game elements
-        game.draw_frame(screen)
+            # Update display
+            pygame.display.update(rects)  # Update only rects modified in this frame
+            frame_time = time.perf_counter() - frame_start
+            frames += 1
+            frame_seconds += frame_time
+            max_frame_seconds = max(max_frame_seconds, frame_time)
 
-        # Update display
-        pygame.display.flip()  # Update only rects modified in this frame
+            # Limit framerate, eg: while dragging a piece
+            clock.tick(FPS)
 
-        # Limit framerate
-        clock.tick(FPS)
+    if show_frame_stats:
+        seconds = time.perf_counter() - loop_start
+        print("%d frames in %.1fs: %.2f ms average, %.2f ms longest. CPU usage %.1f%%" %
+              (frames, seconds, 1000 * frame_seconds / frames if frames else 0, 1000 * max_frame_seconds,
+               100 * (time.process_time() - cpu_start) / seconds if seconds else 0))
+    game.close()
     pygame.quit()
 
 
 if __name__ == '__main__':
-    play_chess()
+    parser = argparse.ArgumentParser(description="Play chess.")
+    parser.add_argument('--lazy', action='store_true', help="load images when first drawn, instead of at startup")
+    parser.add_argument('--startup-times', action='store_true', help="print the time taken to start up")
+    parser.add_argument('--frame-stats', action='store_true',
+                        help="print the frame times and CPU usage when the game is closed")
+    parser.add_argument('--computer', choices=['white', 'black'], help="colour for the computer to play")
+    parser.add_argument('--think-time', type=float, default=2.0,
+                        help="seconds the computer thinks for each move (default: 2)")
+    parser.add_argument('--analysis', action='store_true',
+                        help="show the engine's evaluation below the board while playing (toggle with A)")
+    parser.add_argument('--book', help="Polyglot opening book for the computer to play from (see book.py)")
+    args = parser.parse_args()
+    play_chess(preload=not args.lazy, show_startup_times=args.startup_times, show_frame_stats=args.frame_stats,
+               computer_colour=None if args.computer is None else ['white', 'black'].index(args.computer),
+               think_time=args.think_time, analysis=args.analysis, book_path=args.book)
@@ -0,0 +1,569 @@
+# Computer opponent: finds a move by searching the tree of moves with the rules in Board.
+#
+# The search is a negamax alpha-beta search with iterative deepening. Each depth is searched in turn until the time
+# runs out, and the best move from the deepest completed depth is played. Earlier depths fill the transposition table
+# with best moves, which are tried first at the next depth so that most of the tree can be cut off. Other moves are
+# ordered with captures first (most valuable victim, least valuable attacker), then killer moves and the history
+# heuristic. At the end of the main search, a quiescence search plays out captures so that positions are not
+# evaluated in the middle of an exchange.
+#
+# Usage:
+#     python engine.py --time 5              Search the starting position for 5 seconds.
+#     python engine.py --fen FEN --depth 4   Search a position to depth 4.
+#     python engine.py --time 5 --workers 8  Share the moves from the position between 8 processes.
+#     python engine.py --depth 4 --scaling   Compare the time taken with 1, 2, 4, ... processes, up to --workers.
+#     python engine.py --book book.bin       Play from an opening book (see book.py) while the position is in it.
+#
+# Threads can't run Python code in parallel, so parallel_search shares the moves from the position between processes
+# instead. See parallel_search. EngineWorker runs a search in a background process, for callers which can't wait for it.
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import time
+
+from board import Board, START_FEN
+from book import OpeningBook
+import evaluation
+import exceptions
+import pieces
+from transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+
+# Scores above MATE - MAX_PLY are checkmates. The difference from MATE is the number of plies to checkmate.
+MATE = 100000
+MAX_PLY = 64
+
+# How often (in nodes) the search checks the time.
+TIME_CHECK_INTERVAL = 256
+
+# Number of times an EngineWorker starts a new process after its process dies, before giving up.
+MAX_WORKER_RESTARTS = 3
+
+
+class SearchResult(namedtuple('SearchResult', ['move', 'score', 'depth', 'nodes', 'seconds',
+                                               'principal_variation'])):
+    # Result of searching a position to a depth.
+    #     move -- best move found (board.Move)
+    #     score -- centipawns for the player to move. See MATE for checkmates.
+    #     principal_variation -- expected line of play, starting with move.
+    __slots__ = ()
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        if abs(self.score) > MATE - MAX_PLY:
+            moves_to_mate = (MATE - abs(self.score) + 1) // 2
+            score = 'mate %d' % (moves_to_mate if self.score > 0 else -moves_to_mate)
+        else:
+            score = 'cp %d' % self.score
+        return 'depth %d score %s nodes %d time %.2fs nps %.0f pv %s' % (
+            self.depth, score, self.nodes, self.seconds, self.nodes_per_second,
+            ' '.join(str(move) for move in self.principal_variation))
+
+    def get_next_result(self):
+        # Expected result for the position after this result's move: the rest of the principal variation, one ply
+        # shallower, for the other player. None if there are no more moves in the principal variation.
+        if len(self.principal_variation) < 2:
+            return None
+        # A checkmate is one ply closer from the next position, in the same way as for a child in the table.
+        return SearchResult(self.principal_variation[1], -get_score_for_table(self.score, 1), self.depth - 1, 0, 0.0,
+                            self.principal_variation[1:])
+
+
+def get_captured_piece(board, move):
+    # Piece captured by a move, or None.
+    if move.new_y * 8 + move.new_x == board.en_passant and isinstance(board.piece_grid[move.x][move.y], pieces.Pawn):
+        return board.get_en_passant_pawn()
+    return board.piece_grid[move.new_x][move.new_y]
+
+
+def get_score_for_table(score, ply):
+    # Checkmate scores are stored counting from the position, rather than from the root, so that they are still correct
+    # when the position is reached at a different ply.
+    if score > MATE - MAX_PLY:
+        return score + ply
+    if score < -MATE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def get_score_from_table(score, ply):
+    if score > MATE - MAX_PLY:
+        return score - ply
+    if score < -MATE + MAX_PLY:
+        return score + ply
+    return score
+
+
+def get_book_result(book, board):
+    # SearchResult for the highest weighted move from the position in a book.OpeningBook, or None if the position isn't
+    # in the book. Book moves are found at depth 0, without searching.
+    move = book.choose_move(board) if book else None
+    return SearchResult(move, 0, 0, 0, 0.0, [move]) if move else None
+
+
+class Engine:
+    def __init__(self, hash_mb=16, book=None):
+        # book -- book.OpeningBook to play from while the position is in it
+        self.table = TranspositionTable(hash_mb)
+        self.book = book
+        # Quiet moves which caused a cut-off, for each ply. Tried early in sibling positions.
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        # Bonus for quiet moves that caused cut-offs anywhere in the tree. history[colour][move]
+        self.history = {}, {}
+
+        self.nodes = 0
+        self.deadline = None
+        # Function called with no arguments during the search. If it returns True, the search stops as if the time had
+        # run out. See EngineWorker.
+        self.should_stop = None
+
+    def search(self, board, time_limit=None, max_depth=MAX_PLY, info=None):
+        # Search the position for the player whose turn it is. Returns the SearchResult from the deepest completed
+        # depth. Stops at max_depth, when a checkmate is found, or after time_limit seconds.
+        # info is called with the SearchResult after each depth.
+        # Raises TimeControlError if the time runs out before a single depth is complete.
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        root_moves = len(board.undo_stack)
+
+        if not board.get_legal_moves():
+            raise ValueError("No legal moves in this position")
+        result = get_book_result(self.book, board)
+        if result:
+            if info:
+                info(result)
+            return result
+
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self.negamax(board, depth, -MATE - 1, MATE + 1, 0)
+            except exceptions.SearchTimeoutError:
+                # Undo the moves of the unfinished search
+                while len(board.undo_stack) > root_moves:
+                    board.unmake_move()
+                break
+            principal_variation = self.get_principal_variation(board, depth)
+            result = SearchResult(principal_variation[0], score, depth, self.nodes, time.perf_counter() - start,
+                                  principal_variation)
+            if info:
+                info(result)
+            if abs(score) > MATE - MAX_PLY:
+                break
+
+        if result is None:
+            raise exceptions.TimeControlError(board.active_colour)
+        return result
+
+    def check_time(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise exceptions.SearchTimeoutError()
+        if self.should_stop is not None and self.should_stop():
+            raise exceptions.SearchTimeoutError()
+
+    def get_principal_variation(self, board, depth):
+        # Follow the best moves stored in the transposition table from the current position.
+        moves = []
+        while len(moves) < depth:
+            entry = self.table.probe(board.zobrist_key)
+            if not entry or not entry.best_move or entry.best_move not in board.get_legal_moves():
+                break
+            moves.append(entry.best_move)
+            board.make_move(entry.best_move)
+        for _ in moves:
+            board.unmake_move()
+        return moves
+
+    def order_moves(self, board, moves, best_move, ply):
+        killers = self.killers[ply]
+        history = self.history[board.active_colour]
+        grid = board.piece_grid
+
+        def get_priority(move):
+            if move == best_move:
+                return 1 << 30
+            captured_piece = get_captured_piece(board, move)
+            if captured_piece or move.promotion:
+                # Most valuable victim, least valuable attacker
+                victim = evaluation.PIECE_VALUES[type(captured_piece)] if captured_piece else 0
+                promotion = evaluation.PIECE_VALUES[move.promotion] if move.promotion else 0
+                attacker = evaluation.PIECE_VALUES[type(grid[move.x][move.y])]
+                return (1 << 28) + (victim + promotion) * 16 - attacker // 100
+            if move in killers:
+                return 1 << 27
+            return history.get(move, 0)
+
+        moves.sort(key=get_priority, reverse=True)
+        return moves
+
+    def negamax(self, board, depth, alpha, beta, ply):
+        # Score of the position for the player to move, searched depth moves deep.
+        # If the score is at most alpha or at least beta, only that bound is accurate.
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_INTERVAL == 0:
+            self.check_time()
+
+        key = board.zobrist_key
+        if ply > 0 and (board.position_counts[key] > 1 or board.halfmove_clock >= 100):
+            return 0  # Repeated position, or no progress. Treat as a draw.
+
+        entry = self.table.probe(key)
+        best_move = None
+        if entry:
+            best_move = entry.best_move
+            if ply > 0 and entry.depth >= depth:
+                score = get_score_from_table(entry.score, ply)
+                if entry.bound == EXACT:
+                    return score
+                if entry.bound == LOWER_BOUND and score >= beta:
+                    return score
+                if entry.bound == UPPER_BOUND and score <= alpha:
+                    return score
+
+        moves = entry.legal_moves if entry and entry.legal_moves is not None else board.get_legal_moves()
+        if not moves:
+            in_check = bool(board.get_check_info(board.active_colour)[0])
+            return -MATE + ply if in_check else 0
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(board, alpha, beta, ply)
+
+        original_alpha = alpha
+        best_score = -MATE - 1
+        for move in self.order_moves(board, list(moves), best_move, ply):
+            board.make_move(move)
+            score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if not get_captured_piece(board, move) and not move.promotion:
+                    killers = self.killers[ply]
+                    if move != killers[0]:
+                        killers[1], killers[0] = killers[0], move
+                    history = self.history[board.active_colour]
+                    history[move] = history.get(move, 0) + depth * depth
+                break
+
+        if best_score <= original_alpha:
+            bound = UPPER_BOUND
+        elif best_score >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.table.store(key, depth, get_score_for_table(best_score, ply), bound, best_move, moves)
+        return best_score
+
+    def quiescence(self, board, alpha, beta, ply):
+        # Play out captures and promotions until the position is quiet, then evaluate it.
+        # A player in check has to get out of it, so every evasion is searched instead. MAX_PLY stops a run of checks.
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_INTERVAL == 0:
+            self.check_time()
+
+        moves = board.get_legal_moves()
+        in_check = ply < MAX_PLY and bool(board.get_check_info(board.active_colour)[0])
+        if in_check:
+            if not moves:
+                return -MATE + ply
+            moves = list(moves)
+        else:
+            # The player to move can usually do at least as well as the current evaluation by not capturing.
+            stand_pat = evaluation.evaluate(board)
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            moves = [move for move in moves if move.promotion or get_captured_piece(board, move)]
+
+        for move in self.order_moves(board, moves, None, min(ply, MAX_PLY)):
+            board.make_move(move)
+            score = -self.quiescence(board, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+
+# Engine for each worker process, kept between tasks so that its transposition table is reused at the next depth.
+worker_engine = None
+
+
+def init_worker(hash_mb):
+    global worker_engine
+    worker_engine = Engine(hash_mb)
+
+
+def search_root_move(packed, position_counts, move, depth, deadline):
+    # Score of one move from the position, searched to depth in a worker process. packed is the position before the
+    # move (see Board.pack), and position_counts is Board.position_counts for the game so far, so that repetitions are
+    # found. deadline is a time.time() value or None.
+    # Returns (score, nodes, principal_variation), or None if the time ran out.
+    engine = worker_engine
+    board = Board(packed=packed)
+    board.position_counts = dict(position_counts)
+    engine.nodes = 0
+    engine.deadline = time.perf_counter() + deadline - time.time() if deadline is not None else None
+    board.make_move(move)
+    try:
+        score = -engine.negamax(board, depth - 1, -MATE - 1, MATE + 1, 1)
+    except exceptions.SearchTimeoutError:
+        return None
+    return score, engine.nodes, [move] + engine.get_principal_variation(board, depth - 1)
+
+
+def parallel_search(board, workers, time_limit=None, max_depth=MAX_PLY, info=None, hash_mb=16, book=None):
+    # Same as Engine.search, with the moves from the position shared between worker processes at each depth.
+    # Each move is searched with a full window, so its score doesn't depend on the other moves. This searches more
+    # nodes than a single alpha-beta search, but needs no communication between the workers. The best move is chosen
+    # in the order of board.get_legal_moves(), so ties go the same way however the work was scheduled.
+    start = time.perf_counter()
+    deadline = time.time() + time_limit if time_limit is not None else None
+    moves = board.get_legal_moves()
+    if not moves:
+        raise ValueError("No legal moves in this position")
+    result = get_book_result(book, board)
+    if result:
+        if info:
+            info(result)
+        return result
+    packed = board.pack()
+
+    nodes = 0
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(hash_mb,)) as executor:
+        for depth in range(1, max_depth + 1):
+            futures = [executor.submit(search_root_move, packed, board.position_counts, move, depth, deadline)
+                       for move in moves]
+            results = [future.result() for future in futures]
+            if None in results:
+                break
+            nodes += sum(move_result[1] for move_result in results)
+            score, _, principal_variation = max(results, key=lambda move_result: move_result[0])
+            result = SearchResult(principal_variation[0], score, depth, nodes, time.perf_counter() - start,
+                                  principal_variation)
+            if info:
+                info(result)
+            if abs(score) > MATE - MAX_PLY:
+                break
+
+    if result is None:
+        raise exceptions.TimeControlError(board.active_colour)
+    return result
+
+
+def run_engine_worker(connection, current_request, hash_mb):
+    # Main loop of an EngineWorker's process. Receives (request ID, packed position, position counts, time limit,
+    # max depth) for each search, and sends ('info', request ID, SearchResult) after each depth, then
+    # ('done', request ID, SearchResult or None). A search stops as soon as current_request no longer holds its ID.
+    # The Engine is kept between searches, so its transposition table carries over from one position to the next.
+    engine = Engine(hash_mb)
+    request_id = None
+    engine.should_stop = lambda: current_request.value != request_id
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        request_id, packed, position_counts, time_limit, max_depth = message
+        if current_request.value != request_id:
+            continue  # Cancelled before it started
+        board = Board(packed=packed)
+        board.position_counts = dict(position_counts)
+        try:
+            result = engine.search(board, time_limit, max_depth,
+                                   info=lambda depth_result: connection.send(('info', request_id, depth_result)))
+        except (exceptions.TimeControlError, ValueError):
+            result = None  # Stopped before the first depth was complete, or no legal moves
+        connection.send(('done', request_id, result))
+
+
+class EngineWorker:
+    # Engine running in a separate process, so that searching never blocks the caller, eg: the pygame loop.
+    # Start a search with start_search, then call poll whenever convenient to collect results. Nothing waits for the
+    # worker process apart from close. Starting another search, or calling cancel, stops the current search straight
+    # away, and any results still on their way from it are dropped.
+    # If the worker process dies (eg: it is killed, or runs out of memory), its search is lost and a new process is
+    # started. After MAX_WORKER_RESTARTS of these, self.failed is set and no more searches are started.
+
+    def __init__(self, hash_mb=16):
+        self.hash_mb = hash_mb
+        self.restarts = 0
+        self.failed = False
+        self.start_process()
+        self.request_id = 0
+
+        # Zobrist key of the position being searched, or None.
+        self.position_key = None
+        # SearchResult for each depth completed so far, for the current search.
+        self.results = []
+        # The current search has finished.
+        self.done = False
+
+    def start_process(self):
+        # Processes are started with 'spawn', so the worker doesn't inherit the caller's state (eg: a pygame display).
+        context = multiprocessing.get_context('spawn')
+        self.connection, worker_connection = context.Pipe()
+        # ID of the search the worker should be running. 0 => none.
+        self.current_request = context.RawValue('q', 0)
+        self.process = context.Process(target=run_engine_worker,
+                                       args=(worker_connection, self.current_request, self.hash_mb), daemon=True)
+        self.process.start()
+        # Only the worker holds its end of the pipe, so reading from the pipe fails once the worker has died.
+        worker_connection.close()
+
+    def restart(self):
+        # Replace a worker process which has died. The current search is lost.
+        self.cancel()
+        self.connection.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.restarts += 1
+        if self.restarts > MAX_WORKER_RESTARTS:
+            self.failed = True
+        else:
+            self.start_process()
+
+    @property
+    def best(self):
+        # Deepest SearchResult of the current search so far, or None.
+        return self.results[-1] if self.results else None
+
+    @property
+    def busy(self):
+        return self.position_key is not None and not self.done
+
+    def start_search(self, board, time_limit=None, max_depth=MAX_PLY):
+        # Search the position for the player to move. Stops any search already running.
+        # If the last move on the board was the best move found by the last search, the rest of its principal variation
+        # is kept as the first result, so the search carries on from where the last one got to rather than starting
+        # again: the worker's transposition table still holds the last search, so the shallow depths are found again
+        # almost at once, and only deeper results are reported.
+        # Does nothing once self.failed is set.
+        if self.failed:
+            return
+        expected = None
+        best = self.best
+        if best and board.undo_stack and board.key_history[-1] == self.position_key and \
+                board.undo_stack[-1][0] == best.move:
+            expected = best.get_next_result()
+
+        self.request_id += 1
+        self.current_request.value = self.request_id
+        self.position_key = board.zobrist_key
+        self.results = [expected] if expected else []
+        self.done = False
+        try:
+            self.connection.send((self.request_id, board.pack(), board.position_counts, time_limit, max_depth))
+        except OSError:
+            self.restart()
+            self.start_search(board, time_limit, max_depth)
+
+    def cancel(self):
+        self.current_request.value = 0
+        self.position_key = None
+        self.results = []
+        self.done = False
+
+    def poll(self):
+        # Collect the results which have arrived for the current search, without waiting. Returns the new
+        # SearchResults, deepest last. self.done is set once the search has finished.
+        new_results = []
+        if self.failed:
+            return new_results
+        while True:
+            try:
+                if not self.connection.poll():
+                    break
+                kind, request_id, result = self.connection.recv()
+            except (EOFError, OSError):
+                # The worker process has died
+                self.restart()
+                return []
+            if request_id != self.current_request.value:
+                continue  # From a search which has been stopped
+            if kind == 'done':
+                self.done = True
+            if result is not None and (not self.results or result.depth > self.results[-1].depth):
+                new_results.append(result)
+                self.results.append(result)
+        return new_results
+
+    def close(self):
+        if self.failed:
+            return
+        self.current_request.value = 0
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def report_scaling(board, depth, max_workers, hash_mb=16):
+    # Time parallel_search to a fixed depth with 1, 2, 4, ... workers, up to max_workers, and print the speed-up over
+    # 1 worker.
+    worker_counts = [2 ** i for i in range(max_workers.bit_length()) if 2 ** i < max_workers] + [max_workers]
+    print("%7s %10s %9s %11s %8s %10s  %s" % ('Workers', 'Nodes', 'Time', 'Nodes/s', 'Speed-up', 'Efficiency', 'Move'))
+    base_seconds = None
+    for workers in worker_counts:
+        result = parallel_search(board, workers, max_depth=depth, hash_mb=hash_mb)
+        base_seconds = base_seconds or result.seconds
+        speed_up = base_seconds / result.seconds
+        print("%7d %10d %8.2fs %11.0f %7.2fx %9.0f%%  %s" % (workers, result.nodes, result.seconds,
+                                                            result.nodes_per_second, speed_up,
+                                                            100 * speed_up / workers, result.move))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Search a position for the best move.")
+    parser.add_argument('--fen', default=START_FEN, help="position to search (default: starting position)")
+    parser.add_argument('--moves', nargs='*', default=[], help="moves to play first, eg: e2e4 e7e5")
+    parser.add_argument('--time', type=float, default=None, help="seconds to search for")
+    parser.add_argument('--depth', type=int, default=None, help="depth to search to")
+    parser.add_argument('--hash', type=int, default=16, metavar='MB', help="transposition table size (default: 16)")
+    parser.add_argument('--book', help="Polyglot opening book to play from while the position is in it (see book.py)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes to share the moves between (default: 1, no extra processes)")
+    parser.add_argument('--scaling', action='store_true',
+                        help="compare the time taken to search to --depth with different numbers of processes, up to "
+                             "--workers (default: the number of CPUs)")
+    args = parser.parse_args(args)
+    if args.scaling and args.depth is None:
+        parser.error("--scaling needs --depth")
+    if args.time is None and args.depth is None:
+        args.time = 5.0
+
+    board = Board(args.fen)
+    for text in args.moves:
+        board.make_move(board.get_move(text))
+
+    if args.scaling:
+        report_scaling(board, args.depth, args.workers if args.workers > 1 else os.cpu_count(), args.hash)
+        return
+
+    book = OpeningBook(args.book) if args.book else None
+    try:
+        if args.workers > 1:
+            result = parallel_search(board, args.workers, args.time, args.depth or MAX_PLY, print, args.hash, book)
+        else:
+            result = Engine(args.hash, book).search(board, args.time, args.depth or MAX_PLY, info=print)
+    finally:
+        if book:
+            book.close()
+    print("bestmove " + str(result.move))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# Static evaluation of a position: material, plus a bonus or penalty for where each piece stands.
+#
+# Scores are in centipawns (a pawn is worth 100). The piece-square tables are from the simplified evaluation function
+# by Tomasz Michniewski. They are written from white's side, in the same order as the board is drawn: the first row is
+# rank 8 (y = 0), and each row goes from file a to file h. Black uses the tables mirrored vertically.
+
+import pieces
+
+
+PIECE_VALUES = {
+    pieces.Pawn: 100,
+    pieces.Knight: 320,
+    pieces.Bishop: 330,
+    pieces.Rook: 500,
+    pieces.Queen: 900,
+    pieces.King: 0,  # Both players always have a King
+}
+
+PIECE_SQUARE_TABLES = {
+    pieces.Pawn: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    pieces.Knight: (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ),
+    pieces.Bishop: (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ),
+    pieces.Rook: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ),
+    pieces.Queen: (
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ),
+    pieces.King: (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ),
+}
+
+
+def get_piece_score(piece_class, colour, x, y):
+    # Value of a piece on a square, for its own side.
+    if colour:
+        y = 7 - y
+    return PIECE_VALUES[piece_class] + PIECE_SQUARE_TABLES[piece_class][y * 8 + x]
+
+
+def evaluate(board):
+    # Score of the position for the player whose turn it is. Positive => better for that player.
+    score = 0
+    for colour, sign in ((0, 1), (1, -1)):
+        for piece in board.pieces[colour]:
+            if piece:
+                score += sign * get_piece_score(type(piece), colour, piece.x, piece.y)
+    return -score if board.active_colour else score
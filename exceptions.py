@@ -16,6 +16,15 @@ class PawnPromotionError(Exception):
         return self.pawn, self.x, self.y
 
 
+class SearchTimeoutError(Exception):
+    """
+    Raised inside the engine's search when its time budget runs out.
+
+    Interrupts the search so that the engine can use the result of the last completed depth.
+    """
+    pass
+
+
 class GameOverError(Exception):
     """
     Base class for all user-defined exceptions signalling a completed game.
@@ -0,0 +1,76 @@
+# Turn logic for one game of chess, without any display.
+#
+# Chess draws a Game on screen with pygame, and server.py hosts many Games at once. Both play moves through the same
+# methods, so checks, promotions and the end of the game are handled the same way everywhere.
+
+from board import Board
+import exceptions
+
+
+class Game:
+    def __init__(self, board=None):
+        # board -- Board to play on (default: a new Board in the starting position)
+        self.board = board if board is not None else Board()
+        self.check_flag = False
+        # PawnPromotionError for a pawn waiting for its promotion to be chosen. See promote.
+        self.pawn_promotion = None
+        # GameOverError which ended the game, or None while the game is still going.
+        self.game_over = None
+        # The starting position may already be check, or the end of the game.
+        self.update_status()
+
+    @property
+    def active_colour(self):
+        # 0 => white, 1 => black
+        return self.board.active_colour
+
+    def move_piece(self, piece, x, y):
+        # Move a piece to (x, y), which must be one of its legal moves, and end the turn.
+        # Returns False if the piece is a pawn reaching the back rank. The move then waits in self.pawn_promotion until
+        # a piece is chosen with promote, or it is cancelled with cancel_promotion.
+        try:
+            self.board.move(piece, x, y)
+        except exceptions.PawnPromotionError as e:
+            self.pawn_promotion = e
+            return False
+        self.turnover_move()
+        return True
+
+    def promote(self, promotion_piece):
+        # Finish the move waiting in self.pawn_promotion, promoting the pawn to promotion_piece (a piece class).
+        promotion = self.pawn_promotion
+        self.pawn_promotion = None
+        self.board.promote(promotion, promotion_piece)
+        self.turnover_move()
+
+    def cancel_promotion(self):
+        self.pawn_promotion = None
+
+    def play_move(self, text):
+        # Play a move written in coordinate notation (eg: 'e2e4', 'e7e8q'), or in Standard Algebraic Notation.
+        # Returns the board.Move played. Raises ValueError if the move is not legal, or the game is over.
+        if self.game_over:
+            raise ValueError("Game over: " + self.game_over.message)
+        try:
+            move = self.board.get_move(text)
+        except ValueError:
+            move = self.board.parse_san(text)
+        self.make_move(move)
+        return move
+
+    def make_move(self, move):
+        # Play a legal board.Move, eg: one found by the engine, and end the turn.
+        self.board.make_move(move)
+        self.turnover_move()
+
+    def turnover_move(self):
+        # The board has already switched players.
+        self.update_status()
+
+    def update_status(self):
+        # Find whether the player to move is in check, and whether the game is over.
+        try:
+            self.check_flag = self.board.is_check_or_checkmate(self.active_colour)
+        except exceptions.GameOverError as e:
+            self.check_flag = isinstance(e, exceptions.CheckmateError)
+            self.game_over = e
@@ -0,0 +1,212 @@
+import os
+import time
+
+import pygame
+from board import Board
+import pieces
+
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+
+PIECE_CLASSES = pieces.Pawn, pieces.Knight, pieces.Bishop, pieces.Rook, pieces.Queen, pieces.King
+
+# Images used by the board, other than the pieces. {name: (file name, has transparency)}
+BOARD_IMAGES = {
+    'tiles': ('board-tiles.png', False),
+    'labels_white': ('board-white-labels.png', True),
+    'labels_black': ('board-black-labels.png', True),
+    'pawn_promotions_white': ('w_pawn_promotions.png', True),
+    'pawn_promotions_black': ('b_pawn_promotions.png', True),
+}
+
+
+class AssetCache:
+    # Surfaces loaded from the assets folder, shared by every GraphicalBoard in the process. Each image is loaded from
+    # disk once, either all together by preload(), or the first time it is used. Surfaces are converted to the display
+    # format, so the display mode must be set before anything is loaded.
+
+    def __init__(self):
+        # {(colour, piece class): surface}
+        self.piece_images = {}
+        # {name in BOARD_IMAGES: surface}
+        self.board_images = {}
+        # {(width, height, colour, alpha): surface}
+        self.overlays = {}
+        # {size: pygame default font}
+        self.fonts = {}
+
+        self.loads = 0
+        self.load_seconds = 0.0
+
+    def load(self, file_name, alpha=True):
+        start = time.perf_counter()
+        image = pygame.image.load(os.path.join(ASSETS_DIR, file_name))
+        image = image.convert_alpha() if alpha else image.convert()
+        self.loads += 1
+        self.load_seconds += time.perf_counter() - start
+        return image
+
+    def get_piece_image(self, colour, piece_class):
+        image = self.piece_images.get((colour, piece_class))
+        if image is None:
+            colour_string = "b" if colour else "w"
+            image = self.load(colour_string + "_" + piece_class.name + "_svg_NoShadow-svg.png")
+            self.piece_images[colour, piece_class] = image
+        return image
+
+    def get_board_image(self, name):
+        image = self.board_images.get(name)
+        if image is None:
+            image = self.board_images[name] = self.load(*BOARD_IMAGES[name])
+        return image
+
+    def get_overlay(self, width, height, colour, alpha):
+        # Plain translucent surface, eg: to highlight a tile.
+        key = width, height, colour, alpha
+        surface = self.overlays.get(key)
+        if surface is None:
+            surface = self.overlays[key] = pygame.Surface((width, height))
+            surface.fill(colour)
+            surface.set_alpha(alpha)
+        return surface
+
+    def get_font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            font = self.fonts[size] = pygame.font.Font(None, size)
+        return font
+
+    def preload(self):
+        # Load every image now, rather than when first drawn.
+        for colour in (0, 1):
+            for piece_class in PIECE_CLASSES:
+                self.get_piece_image(colour, piece_class)
+        for name in BOARD_IMAGES:
+            self.get_board_image(name)
+
+    def clear(self):
+        # Forget every surface, eg: after the display mode changes.
+        self.piece_images.clear()
+        self.board_images.clear()
+        self.overlays.clear()
+        self.fonts.clear()
+
+
+assets = AssetCache()
+
+
+class PieceSprite(pygame.sprite.Sprite):
+    def __init__(self, image, x, y):
+        super().__init__()
+        self.image = image
+        self.rect = self.image.get_rect()
+        self.rect.x = x
+        self.rect.y = y
+
+
+class GraphicalBoard(Board):
+    # Board drawn on screen with pygame. Requires an initialised display.
+    # All rules are handled by Board. This class only keeps the sprites in sync with the pieces.
+
+    def __init__(self):
+        self.tile_size = 65
+        self.x_offset = 200
+        self.y_offset = 100
+
+        # Images are shared with other boards, and loaded when first used. See AssetCache.
+        self.moves_overlay = assets.get_overlay(self.tile_size, self.tile_size, (0, 204, 0), 80)
+        self.check_overlay = assets.get_overlay(self.tile_size, self.tile_size, (204, 204, 0), 80)
+
+        # Sprite for each piece on the board. Pieces do not know about their own sprites.
+        self.sprites = {}
+        # Sprites of pieces which have been taken off the board.
+        self.removed_sprites = {}
+
+        # Groups to quickly draw pieces of each colour
+        # piece_sprites[0] => white sprites, piece_sprites[1] => black sprites
+        self.piece_sprites = pygame.sprite.Group(), pygame.sprite.Group()
+
+        # Screen areas where sprites have appeared, moved or disappeared since the screen was last drawn.
+        # See Chess.get_dirty_rects.
+        self.dirty_rects = []
+
+        super().__init__()
+        self.update_sprites()
+
+    @property
+    def tiles(self):
+        return assets.get_board_image('tiles')
+
+    @property
+    def labels_white(self):
+        return assets.get_board_image('labels_white')
+
+    @property
+    def labels_black(self):
+        return assets.get_board_image('labels_black')
+
+    @property
+    def pawn_promotions_white(self):
+        return assets.get_board_image('pawn_promotions_white')
+
+    @property
+    def pawn_promotions_black(self):
+        return assets.get_board_image('pawn_promotions_black')
+
+    def get_board_coords(self, x, y):
+        x, y = (x - self.x_offset) // self.tile_size, (y - self.y_offset) // self.tile_size
+        if x < 0 or x > 7 or y < 0 or y > 7:
+            raise ValueError("Coordinates are not on the board")
+        return x, y
+
+    def get_pixel_coords(self, x, y):
+        # Pixel coordinates relative to top-left corner of the display window.
+        return x * self.tile_size + self.x_offset, y * self.tile_size + self.y_offset
+
+    def get_tile_rect(self, x, y):
+        return pygame.Rect(self.get_pixel_coords(x, y), (self.tile_size, self.tile_size))
+
+    def create_sprite(self, piece):
+        image = assets.get_piece_image(piece.colour, type(piece))
+        return PieceSprite(image, *self.get_pixel_coords(piece.x, piece.y))
+
+    def add_piece_sprite(self, piece):
+        self.piece_sprites[piece.colour].add(self.sprites[piece])
+
+    def update_sprites(self):
+        # Bring the sprites in line with the pieces after the board changes. Called by Chess once each move is played,
+        # rather than from make_move, so that moves which are only tried out (eg: Board.is_check_after_move) never
+        # touch the sprites.
+        # Sprites that have been removed from their group (eg: the piece held by the player) are not added back.
+        active_pieces = [piece for colour in (0, 1) for piece in self.pieces[colour] if piece]
+
+        # Captured pieces, and pawns replaced by a promotion. Keep the sprite in case the move is undone.
+        active_set = set(active_pieces)
+        for piece in [piece for piece in self.sprites if piece not in active_set]:
+            sprite = self.sprites.pop(piece)
+            sprite.kill()
+            self.removed_sprites[piece] = sprite
+            self.dirty_rects.append(sprite.rect.copy())
+
+        for piece in active_pieces:
+            sprite = self.sprites.get(piece)
+            position = self.get_pixel_coords(piece.x, piece.y)
+            if sprite is None:
+                # New piece, or a captured piece put back by unmake_move()
+                sprite = self.removed_sprites.pop(piece, None) or self.create_sprite(piece)
+                self.sprites[piece] = sprite
+                self.add_piece_sprite(piece)
+            elif sprite.rect.topleft != position:
+                self.dirty_rects.append(sprite.rect.copy())
+            else:
+                continue
+            sprite.rect.topleft = position
+            self.dirty_rects.append(sprite.rect.copy())
+
+    def draw_board(self, surface):
+        surface.blit(self.tiles, (self.x_offset, self.y_offset))
+        surface.blit(self.labels_white, (self.x_offset, self.y_offset))
+
+    def draw_pieces(self, surface):
+        self.piece_sprites[0].draw(surface)
+        self.piece_sprites[1].draw(surface)
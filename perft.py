@@ -0,0 +1,229 @@
+# Perft: count every position reachable in a number of moves.
+#
+# Comparing the counts against known results checks that the move generation follows the rules exactly, including
+# castling, en-passant and promotion. Timing the counts measures the speed of the move generation.
+#
+# Usage:
+#     python perft.py                        Run the test positions, and compare against the known counts.
+#     python perft.py 4                      Count positions 4 moves from the starting position.
+#     python perft.py 3 --fen FEN --divide   Count positions for each move from a position separately.
+#     python perft.py --bitboard             Use the bitboard move generator instead of Board.
+#     python perft.py 5 --hash 64            Look up repeated positions in a 64 MB transposition table.
+#     python perft.py 5 --workers 8          Share the moves from the position between 8 processes.
+#     python perft.py 5 --scaling            Compare the time taken with 1, 2, 4, ... processes, up to --workers.
+#
+# Threads can't run Python code in parallel, so the work is shared between processes instead. Each legal move from the
+# position is counted separately by a worker process, which is sent the position packed into bytes (see Board.pack).
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+import time
+
+from board import Board, START_FEN
+import bitboard
+import transposition
+
+
+# Test positions: (name, FEN, known counts for depth 1, 2, 3, ...)
+POSITIONS = [
+    ('Starting position', START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ('Kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    ('En-passant and pins', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624]),
+    ('Promotions and castling', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    ('Promotions and castling, mirrored', 'r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1',
+     [6, 264, 9467, 422333]),
+    ('Promotion by capture', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487]),
+    ('Middlegame', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594]),
+    ('Underpromotions', 'n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1',
+     [24, 496, 9483, 182838, 3605103]),
+]
+
+
+def perft(board, depth, table=None):
+    # Number of positions reachable from the board in exactly depth moves.
+    # If a transposition.TranspositionTable is given, counts for positions reached again by a different order of moves
+    # are looked up instead of counted again.
+    if depth == 0:
+        return 1
+    if table:
+        entry = table.probe(board.zobrist_key)
+        if entry and entry.depth == depth:
+            return entry.score
+    moves = board.get_legal_moves()
+    if depth == 1:
+        nodes = len(moves)
+    else:
+        nodes = 0
+        for move in moves:
+            board.make_move(move)
+            nodes += perft(board, depth - 1, table)
+            board.unmake_move()
+    if table:
+        table.store(board.zobrist_key, depth, nodes)
+    return nodes
+
+
+def perft_bitboard(position, depth):
+    # Same as perft, using a bitboard.BitboardPosition.
+    if depth == 0:
+        return 1
+    moves = position.get_legal_moves()
+    if depth == 1:
+        return len(moves)
+    return sum(perft_bitboard(position.make_move(move), depth - 1) for move in moves)
+
+
+def divide(board, depth, use_bitboard=False, table=None):
+    # Perft counts for each legal move separately. {move in coordinate notation: count}
+    counts = {}
+    if use_bitboard:
+        position = bitboard.BitboardPosition.from_board(board)
+        for move in position.get_legal_moves():
+            counts[str(move)] = perft_bitboard(position.make_move(move), depth - 1)
+    else:
+        for move in board.get_legal_moves():
+            board.make_move(move)
+            counts[str(move)] = perft(board, depth - 1, table)
+            board.unmake_move()
+    return counts
+
+
+# Transposition table for each worker process, kept between tasks. See init_worker.
+worker_table = None
+
+
+def init_worker(hash_mb):
+    global worker_table
+    worker_table = transposition.TranspositionTable(hash_mb) if hash_mb else None
+
+
+def perft_root_move(packed, move, depth, use_bitboard=False):
+    # Perft count for the position after one move, in a worker process. packed is the position before the move.
+    board = Board(packed=packed)
+    if use_bitboard:
+        return perft_bitboard(bitboard.BitboardPosition.from_board(board).make_move(move), depth - 1)
+    board.make_move(move)
+    return perft(board, depth - 1, worker_table)
+
+
+def parallel_divide(board, depth, workers, use_bitboard=False, hash_mb=0):
+    # Same as divide, with the moves shared between worker processes. Each worker has its own transposition table if
+    # hash_mb is given. The counts are in the same order as board.get_legal_moves(), however the work was scheduled.
+    moves = board.get_legal_moves()
+    packed = board.pack()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(hash_mb,)) as executor:
+        futures = [executor.submit(perft_root_move, packed, move, depth, use_bitboard) for move in moves]
+        return {str(move): future.result() for move, future in zip(moves, futures)}
+
+
+def report_scaling(board, depth, max_workers, use_bitboard=False, hash_mb=0):
+    # Time parallel_divide with 1, 2, 4, ... workers, up to max_workers, and print the speed-up over 1 worker.
+    worker_counts = [2 ** i for i in range(max_workers.bit_length()) if 2 ** i < max_workers] + [max_workers]
+    print("%7s %12s %9s %11s %8s %10s" % ('Workers', 'Nodes', 'Time', 'Nodes/s', 'Speed-up', 'Efficiency'))
+    base_seconds = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        nodes = sum(parallel_divide(board, depth, workers, use_bitboard, hash_mb).values())
+        seconds = time.perf_counter() - start
+        base_seconds = base_seconds or seconds
+        speed_up = base_seconds / seconds
+        print("%7d %12d %8.2fs %11.0f %7.2fx %9.0f%%" %
+              (workers, nodes, seconds, nodes / seconds, speed_up, 100 * speed_up / workers))
+
+
+def timed_perft(fen, depth, use_bitboard=False):
+    # Returns (node count, seconds taken).
+    board = Board(fen)
+    start = time.perf_counter()
+    if use_bitboard:
+        nodes = perft_bitboard(bitboard.BitboardPosition.from_board(board), depth)
+    else:
+        nodes = perft(board, depth)
+    return nodes, time.perf_counter() - start
+
+
+def run_suite(max_nodes, use_bitboard=False):
+    # Run each test position to the deepest depth whose known count is at most max_nodes.
+    # Prints a line per position, and returns True if every count was correct.
+    passed = True
+    total_nodes, total_seconds = 0, 0
+    for name, fen, counts in POSITIONS:
+        depth = max([1] + [depth for depth, count in enumerate(counts, 1) if count <= max_nodes])
+        nodes, seconds = timed_perft(fen, depth, use_bitboard)
+        ok = nodes == counts[depth - 1]
+        passed = passed and ok
+        total_nodes += nodes
+        total_seconds += seconds
+        print("%-36s depth %d %10d nodes %8.2fs %9.0f nodes/s  %s" %
+              (name, depth, nodes, seconds, nodes / seconds, 'ok' if ok else 'FAILED, expected %d' % counts[depth - 1]))
+    print("%-36s %18d nodes %8.2fs %9.0f nodes/s" % ('Total', total_nodes, total_seconds, total_nodes / total_seconds))
+    return passed
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Count positions reachable in a number of moves.")
+    parser.add_argument('depth', type=int, nargs='?', help="number of moves. Runs the test positions if not given")
+    parser.add_argument('--fen', default=START_FEN, help="position to start from (default: starting position)")
+    parser.add_argument('--moves', nargs='*', default=[], help="moves to play first, eg: e2e4 e7e5")
+    parser.add_argument('--divide', action='store_true', help="show the count for each move separately")
+    parser.add_argument('--bitboard', action='store_true', help="use the bitboard move generator")
+    parser.add_argument('--max-nodes', type=int, default=100000,
+                        help="largest known count to run for each test position (default: 100000)")
+    parser.add_argument('--hash', type=int, default=0, metavar='MB',
+                        help="size of the transposition table for repeated positions (default: 0, no table)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes to share the moves between (default: 1, no extra processes)")
+    parser.add_argument('--scaling', action='store_true',
+                        help="compare the time taken with different numbers of processes, up to --workers "
+                             "(default: the number of CPUs)")
+    args = parser.parse_args(args)
+    table = transposition.TranspositionTable(args.hash) if args.hash and args.workers == 1 else None
+
+    if args.depth is None:
+        return 0 if run_suite(args.max_nodes, args.bitboard) else 1
+
+    board = Board(args.fen)
+    for text in args.moves:
+        board.make_move(board.get_move(text))
+
+    if args.scaling:
+        max_workers = args.workers if args.workers > 1 else os.cpu_count()
+        report_scaling(board, args.depth, max_workers, args.bitboard, args.hash)
+        return 0
+
+    start = time.perf_counter()
+    if args.workers > 1:
+        counts = parallel_divide(board, args.depth, args.workers, args.bitboard, args.hash)
+        if args.divide:
+            for move in sorted(counts):
+                print("%s: %d" % (move, counts[move]))
+        nodes = sum(counts.values())
+    elif args.divide:
+        counts = divide(board, args.depth, args.bitboard, table)
+        for move in sorted(counts):
+            print("%s: %d" % (move, counts[move]))
+        nodes = sum(counts.values())
+    elif args.bitboard:
+        nodes = perft_bitboard(bitboard.BitboardPosition.from_board(board), args.depth)
+    else:
+        nodes = perft(board, args.depth, table)
+    seconds = time.perf_counter() - start
+    print("Nodes: %d" % nodes)
+    print("Time: %.2fs (%.0f nodes/s)" % (seconds, nodes / seconds if seconds else 0))
+    if table:
+        stats = table.get_stats()
+        print("Hash: %(used)d/%(size)d slots used, %(hits)d hits, %(misses)d misses (%(collisions)d collisions), "
+              "%(overwrites)d overwrites" % stats)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+# Replay games from PGN (Portable Game Notation) files with the rules in Board.
+#
+# Every move of every game is checked for legality, and the way each game ended is found from its final position:
+# checkmate, stalemate, the fifty-move rule, or repetition. The file is read one line at a time, and the report is
+# written one game at a time, so archives of any size can be checked in constant memory.
+#
+# Usage:
+#     python pgn.py games.pgn                         Print a line for each game.
+#     python pgn.py games.pgn --output report.tsv     Write the report to a file instead.
+#     python pgn.py games.pgn --workers 8             Share the games between 8 processes.
+#     python pgn.py --test                            Replay the test games, and compare against the known results.
+#
+# Report columns (tab-separated):
+#     number -- number of the game in the file, starting at 1
+#     white, black, result -- from the game's tags
+#     plies -- number of moves replayed
+#     ending -- 'checkmate', 'stalemate', 'fifty moves' or 'repetition' if the final position ends the game, otherwise
+#               empty (eg: the game ended by resignation)
+#     error -- the first illegal move, if any
+
+import argparse
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import re
+import sys
+import time
+
+from board import Board
+import exceptions
+
+
+RESULTS = '1-0', '0-1', '1/2-1/2', '*'
+
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]')
+TOKEN_PATTERN = re.compile(r'[{}();]|[^\s{}();]+')
+# Move number in front of a move, eg: '12.' or '12...' in '12...Nf6'. The dots are needed, so that castling written
+# with zeros ('0-0') isn't taken for a move number.
+MOVE_NUMBER_PATTERN = re.compile(r'^\d+\.+')
+
+# Number of games sent to a worker process at a time
+BATCH_SIZE = 64
+
+# Game read from a PGN file. tags is {name: value}, moves is a list of moves in SAN.
+Game = namedtuple('Game', ['number', 'tags', 'moves'])
+
+# Result of replaying a game. See the report columns above.
+GameReport = namedtuple('GameReport', ['number', 'white', 'black', 'result', 'plies', 'ending', 'error'])
+
+# Test games: (PGN, known plies, known ending). Checked by run_tests.
+TEST_GAMES = [
+    ('1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6 4. Qxf7# 1-0', 7, 'checkmate'),
+    ('1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. 0-0 Nf6 5. d3 0-0 *', 10, ''),
+    ('1. d4 d5 2. Nc3 Nc6 3. Bf4 Bf5 4. Qd2 Qd7 5. 0-0-0 0-0-0 *', 10, ''),
+    ('1.e4 e5 2.Nf3 Nf6 3.Bc4 Bc5 4.O-O 4...O-O 5.d3 5...d6 *', 10, ''),
+    ('1. e4 e5 2. Nf3 Nf6 3. Bc4 Bc5 4. 0-0 4...0-0 *', 8, ''),
+]
+
+# Ending for each cause of StalemateError
+STALEMATE_ENDINGS = {'No moves': 'stalemate', 'No progress': 'fifty moves', 'Repeated moves': 'repetition'}
+
+
+def read_games(lines):
+    # Games from an iterable of lines of PGN (eg: an open file), one at a time.
+    # Comments, variations and annotations are skipped.
+    number = 0
+    tags = {}
+    moves = []
+    in_comment = False
+    variation_depth = 0
+    for line in lines:
+        if not in_comment and line.startswith('%'):
+            continue  # Escaped line
+        if not in_comment and line.startswith('['):
+            match = TAG_PATTERN.match(line)
+            if match:
+                if moves:
+                    # New game, without a result at the end of the previous one
+                    number += 1
+                    yield Game(number, tags, moves)
+                    tags, moves = {}, []
+                tags[match.group(1)] = match.group(2)
+                continue
+
+        for token in TOKEN_PATTERN.findall(line):
+            if in_comment:
+                in_comment = token != '}'
+            elif token == '{':
+                in_comment = True
+            elif token == ';':
+                break  # Comment to the end of the line
+            elif token == '(':
+                variation_depth += 1
+            elif token == ')':
+                variation_depth -= 1
+            elif variation_depth or token.startswith('$'):
+                continue
+            elif token in RESULTS:
+                number += 1
+                yield Game(number, tags, moves)
+                tags, moves = {}, []
+            else:
+                token = MOVE_NUMBER_PATTERN.sub('', token)
+                if token:
+                    moves.append(token)
+
+    if moves or tags:
+        number += 1
+        yield Game(number, tags, moves)
+
+
+def replay_game(game):
+    # Play through a game, checking each move. Returns a GameReport.
+    tags = game.tags
+    error = ''
+    ending = ''
+    plies = 0
+    try:
+        board = Board.from_fen(tags['FEN']) if 'FEN' in tags else Board()
+        for san in game.moves:
+            board.make_move(board.parse_san(san))
+            plies += 1
+    except ValueError as e:
+        error = str(e)
+    except Exception as e:
+        # Any other failure is still caused by this game's moves or tags. It is reported, and the other games go on.
+        error = "%s: %s" % (type(e).__name__, e)
+    else:
+        try:
+            board.is_check_or_checkmate(board.active_colour)
+        except exceptions.CheckmateError:
+            ending = 'checkmate'
+        except exceptions.StalemateError as e:
+            ending = STALEMATE_ENDINGS[e.cause]
+    return GameReport(game.number, tags.get('White', '?'), tags.get('Black', '?'), tags.get('Result', '*'), plies,
+                      ending, error)
+
+
+def replay_batch(games):
+    return [replay_game(game) for game in games]
+
+
+def get_batches(games, size):
+    batch = []
+    for game in games:
+        batch.append(game)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def replay_games(games, workers=1):
+    # GameReport for each game, in the same order. With more than 1 worker, batches of games are replayed in worker
+    # processes. Only a few batches per worker are read ahead, so memory use doesn't grow with the number of games.
+    if workers <= 1:
+        for game in games:
+            yield replay_game(game)
+        return
+
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for batch in get_batches(games, BATCH_SIZE):
+            pending.append(executor.submit(replay_batch, batch))
+            if len(pending) >= 4 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def run_tests():
+    # Replay the test games, and print whether each one gives the known result. Returns the number which don't.
+    failures = 0
+    games = read_games(pgn_text + '\n' for pgn_text, _, _ in TEST_GAMES)
+    for report, (pgn_text, plies, ending) in zip(replay_games(games), TEST_GAMES):
+        ok = (report.plies, report.ending, report.error) == (plies, ending, '')
+        failures += not ok
+        print("%-60s %d plies %-10s %s" % (pgn_text, report.plies, report.ending or '-',
+                                           'ok' if ok else 'FAILED ' + report.error))
+    return failures
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Check every move of the games in a PGN file, and find how each "
+                                                 "game ended.")
+    parser.add_argument('file', nargs='?', help="PGN file to read, or - for standard input")
+    parser.add_argument('--output', help="file to write the report to (default: standard output)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes to share the games between (default: 1, no extra processes)")
+    parser.add_argument('--test', action='store_true', help="replay the test games instead of a file")
+    args = parser.parse_args(args)
+    if args.test:
+        return 1 if run_tests() else 0
+    if args.file is None:
+        parser.error("a PGN file is needed, unless --test is given")
+
+    pgn_file = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8', errors='replace')
+    output = open(args.output, 'w') if args.output else sys.stdout
+    games = plies = illegal = 0
+    start = time.perf_counter()
+    try:
+        output.write('\t'.join(GameReport._fields) + '\n')
+        for report in replay_games(read_games(pgn_file), args.workers):
+            output.write('\t'.join(str(value) for value in report) + '\n')
+            games += 1
+            plies += report.plies
+            illegal += bool(report.error)
+            if games % 1000 == 0:
+                seconds = time.perf_counter() - start
+                print("%d games, %.0f games/s" % (games, games / seconds), file=sys.stderr)
+    finally:
+        if pgn_file is not sys.stdin:
+            pgn_file.close()
+        if output is not sys.stdout:
+            output.close()
+
+    seconds = time.perf_counter() - start
+    print("%d games, %d moves, %d with illegal moves in %.2fs (%.1f games/s, %.0f moves/s)" %
+          (games, plies, illegal, seconds, games / seconds if seconds else 0, plies / seconds if seconds else 0),
+          file=sys.stderr)
+    return 1 if illegal else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
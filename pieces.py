@@ -8,26 +8,25 @@
 # Rule - pieces cannot touch other pieces. They can check the board, but not modify anything else on it
 #      - pieces do not implement how they capture other pieces
 
-import pygame
+# Rule - pieces know nothing about how they are displayed. Sprites are handled by graphics.GraphicalBoard.
 
-
-class PieceSprite(pygame.sprite.Sprite):
-    def __init__(self, image, x, y):
-        super().__init__()
-        self.image = image
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
+ROOK_DIRECTIONS = (1, 0), (-1, 0), (0, 1), (0, -1)
+BISHOP_DIRECTIONS = (1, 1), (-1, 1), (1, -1), (-1, -1)
+KNIGHT_DELTAS = (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)
 
 
 class Piece:
-    def __init__(self, colour, x, y, board, piece_id, sprite_stem):
+    # Name used to find the piece's image, and letter used in FEN and move notation. Overwrite in subclasses.
+    name = None
+    symbol = None
+
+    # Pieces have no __dict__, to keep each one small. Subclasses with more attributes must add them to __slots__.
+    __slots__ = 'colour', 'board', 'id', 'x', 'y', 'valid_moves', 'protected_squares'
+
+    def __init__(self, colour, x, y, board, piece_id):
         self.colour = self.validate_colour(colour)  # 0 => white, 1 => black
         self.board = board
-        # Each piece of a colour has a unique ID determined by its starting rank and file.
-        # Pawns have IDs 0 through 7 for files 1 through 8 respectively.
-        # Back row pieces have IDs 8 through 15 for files 1 through 8 respectively.
-        # eg: Both Kings have an ID of 12.
+        # Each piece of a colour has a unique ID, giving its position in board.pieces. See Board.__init__.
         self.id = piece_id
 
         # Grid coordinates of the piece on the board. Integers 0 to 7 only
@@ -37,12 +36,6 @@ class Piece:
         self.valid_moves = []
         self.protected_squares = []
 
-        if sprite_stem:
-            colour_string = "b" if self.colour else "w"
-            image_file = "assets/" + colour_string + "_" + sprite_stem + "_svg_NoShadow-svg.png"
-            image = pygame.image.load(image_file).convert_alpha()
-            self.sprite = PieceSprite(image, *self.pixel_coords)
-
     @staticmethod
     def validate_coord(coord):
         if not isinstance(coord, int):
@@ -61,15 +54,8 @@ class Piece:
     def coords(self):
         return self.x, self.y
 
-    @property
-    def pixel_coords(self):
-        # Pixel coordinates relative to top-left corner of the display window.
-        # Used for drawing sprites to the screen.
-        return self.board.get_pixel_coords(self.x, self.y)
-
     def add_valid_move(self, x, y):
-        check_after_move = self.board.is_check_after_move(self, x, y)
-        if not check_after_move:
+        if self.board.is_legal_move(self, x, y):
             self.valid_moves.append((x, y))
 
     def get_valid_moves(self):
@@ -90,8 +76,7 @@ class Piece:
 
 
 class RangedPiece(Piece):
-    def __init__(self, colour, x, y, board, piece_id, sprite_stem):
-        super().__init__(colour, x, y, board, piece_id, sprite_stem)
+    __slots__ = ()
 
     def probe_path(self, update_func, protected_squares_flag=False):
         try:
@@ -99,14 +84,13 @@ class RangedPiece(Piece):
             x_probe, y_probe = update_func(self.x, self.y)
             probe_piece = self.board.piece_grid[x_probe][y_probe]
             # Probe as long as the path is not blocked.
-            # An EnPassanePawn does not block the path. Neither does the opponent's King. This allows ranged pieces to
-            # protect squares beyond the King, and prevents the King from being able to stay in check if it moves.
-            while probe_piece is None or isinstance(probe_piece, EnPassantPawn) or \
-                    (isinstance(probe_piece, King) and probe_piece.colour != self.colour):
+            # The opponent's King does not block the path. This allows ranged pieces to protect squares beyond the
+            # King, and prevents the King from being able to stay in check if it moves.
+            while probe_piece is None or (isinstance(probe_piece, King) and probe_piece.colour != self.colour):
                 if protected_squares_flag:
                     self.protected_squares.append((x_probe, y_probe))
                 if not protected_squares_flag:
-                    if probe_piece is None or isinstance(probe_piece, EnPassantPawn):
+                    if probe_piece is None:
                         self.add_valid_move(x_probe, y_probe)
                     else:
                         break  # If looking for valid moves, the opponent's King blocks the path.
@@ -148,8 +132,12 @@ class RangedPiece(Piece):
 
 
 class Rook(RangedPiece):
+    name = "rook"
+    symbol = "r"
+    __slots__ = 'has_moved',
+
     def __init__(self, colour, x, y, board, piece_id):
-        super().__init__(colour, x, y, board, piece_id, "rook")
+        super().__init__(colour, x, y, board, piece_id)
         self.has_moved = False
 
     def get_moves_get_protected_squares(self, protected_squares_flag=False):
@@ -160,8 +148,9 @@ class Rook(RangedPiece):
 
 
 class Bishop(RangedPiece):
-    def __init__(self, colour, x, y, board, piece_id):
-        super().__init__(colour, x, y, board, piece_id, "bishop")
+    name = "bishop"
+    symbol = "b"
+    __slots__ = ()
 
     def get_moves_get_protected_squares(self, protected_squares_flag=False):
         self.probe_path(self.update_higher_x_higher_y, protected_squares_flag)
@@ -171,8 +160,9 @@ class Bishop(RangedPiece):
 
 
 class Queen(RangedPiece):
-    def __init__(self, colour, x, y, board, piece_id):
-        super().__init__(colour, x, y, board, piece_id, "queen")
+    name = "queen"
+    symbol = "q"
+    __slots__ = ()
 
     def get_moves_get_protected_squares(self, protected_squares_flag=False):
         self.probe_path(self.update_higher_x, protected_squares_flag)
@@ -186,10 +176,19 @@ class Queen(RangedPiece):
 
 
 class Pawn(Piece):
+    name = "pawn"
+    symbol = "p"
+    __slots__ = 'step',
+
     def __init__(self, colour, x, y, board, piece_id):
-        super().__init__(colour, x, y, board, piece_id, "pawn")
+        super().__init__(colour, x, y, board, piece_id)
         self.step = 1 if self.colour else -1
 
+    def can_capture_en_passant(self, x, y):
+        # Whether (x, y) is the square skipped by an opponent pawn's double-move on the last turn.
+        board = self.board
+        return board.en_passant == y * 8 + x and board.active_colour == self.colour
+
     def get_moves_get_protected_squares(self, protected_squares_flag=False):
         # Straight movement
         if not protected_squares_flag:  # Only applies when looking for valid moves.
@@ -206,7 +205,8 @@ class Pawn(Piece):
                 self.protected_squares.append((new_x, new_y))
             else:
                 right_piece = self.board.piece_grid[new_x][new_y]
-                if right_piece is not None and right_piece.colour != self.colour:
+                if (right_piece is not None and right_piece.colour != self.colour) or \
+                        self.can_capture_en_passant(new_x, new_y):
                     self.add_valid_move(new_x, new_y)
         except ValueError:
             pass
@@ -218,35 +218,27 @@ class Pawn(Piece):
                 self.protected_squares.append((new_x, new_y))
             else:
                 left_piece = self.board.piece_grid[new_x][new_y]
-                if left_piece is not None and left_piece.colour != self.colour:
+                if (left_piece is not None and left_piece.colour != self.colour) or \
+                        self.can_capture_en_passant(new_x, new_y):
                     self.add_valid_move(new_x, new_y)
         except ValueError:
             pass
 
 
-class EnPassantPawn(Piece):
-    def __init__(self, colour, x, y, board, pawn):
-        super().__init__(colour, x, y, board, None, None)
-        self.pawn = pawn
-
-
 class King(Piece):
+    name = "king"
+    symbol = "k"
+    __slots__ = 'has_moved',
+
     def __init__(self, colour, x, y, board, piece_id):
-        super().__init__(colour, x, y, board, piece_id, "king")
+        super().__init__(colour, x, y, board, piece_id)
         self.has_moved = False
 
-    def get_opponent_protected_squares(self):
-        protected_squares = []
-        for piece in self.board.pieces[not self.colour]:
-            if piece:
-                protected_squares += piece.get_protected_squares()
-        return protected_squares
+    def is_attacked(self, x, y):
+        # Whether the King would be attacked on (x, y). The King itself doesn't block lines to squares behind it.
+        return self.board.is_square_attacked(x, y, not self.colour)
 
     def get_moves_get_protected_squares(self, protected_squares_flag=False):
-        if not protected_squares_flag:
-            # If calculating valid_moves, find protected squares for all pieces of other colour ahead of time.
-            opponent_protected_squares = self.get_opponent_protected_squares()
-
         # Regular moves
         for delta_x in [-1, 0, 1]:
             try:
@@ -268,7 +260,7 @@ class King(Piece):
                 else:
                     new_space = self.board.piece_grid[new_x][new_y]
                     if new_space is None or new_space.colour != self.colour:
-                        if not (new_x, new_y) in opponent_protected_squares:
+                        if not self.is_attacked(new_x, new_y):
                             self.valid_moves.append((new_x, new_y))
 
         # Castling
@@ -280,29 +272,27 @@ class King(Piece):
             #         1. Rook must not have moved
             #         2. Squares between King and Rook must be empty
             #         3. Squares the King moves through (or to) must not be protected
-            if not self.has_moved and self.coords not in opponent_protected_squares:
+            if not self.has_moved and not self.is_checked():
                 grid = self.board.piece_grid
                 rank = 0 if self.colour else 7
                 # King side
-                king_rook = self.board.pieces[self.colour][15]
-                if king_rook and not king_rook.has_moved:
-                    if all(not grid[file][rank] and (file, rank) not in opponent_protected_squares for file in (5, 6)):
+                if self.board.get_castling_rook(self.colour, king_side=True):
+                    if all(not grid[file][rank] and not self.is_attacked(file, rank) for file in (5, 6)):
                         self.valid_moves.append((6, rank))
                 # Queen side
-                queen_rook = self.board.pieces[self.colour][8]
-                if queen_rook and not queen_rook.has_moved:
+                if self.board.get_castling_rook(self.colour, king_side=False):
                     if not grid[1][rank]:
-                        if all(not grid[file][rank] and (file, rank) not in opponent_protected_squares for file in (2, 3)):
+                        if all(not grid[file][rank] and not self.is_attacked(file, rank) for file in (2, 3)):
                             self.valid_moves.append((2, rank))
 
     def is_checked(self):
-        protected_squares = self.get_opponent_protected_squares()
-        return self.coords in protected_squares
+        return self.board.is_square_attacked(self.x, self.y, not self.colour)
 
 
 class Knight(Piece):
-    def __init__(self, colour, x, y, board, piece_id):
-        super().__init__(colour, x, y, board, piece_id, "knight")
+    name = "knight"
+    symbol = "n"
+    __slots__ = ()
 
     def get_moves_get_protected_squares(self, protected_squares_flag=False):
         self.valid_moves.clear()
@@ -0,0 +1,234 @@
+# Host many games at once in one process, over TCP with a line-based protocol.
+#
+# Each request is one line of text, and gets a reply of one line: 'ok ...' or 'error MESSAGE'.
+#     new [FEN]            Start a game, from the starting position or a position in FEN.  => ok GAME_ID
+#     move GAME_ID MOVE    Play a move, in coordinate notation (eg: e2e4, e7e8q) or SAN.    => ok STATUS
+#     moves GAME_ID        Legal moves for the player to move, in coordinate notation.     => ok MOVE MOVE ...
+#     fen GAME_ID          Current position.                                               => ok FEN
+#     status GAME_ID       => ok STATUS
+#     close GAME_ID        End a game and free its memory.                                 => ok
+# STATUS is one of: playing, check, checkmate, stalemate, fifty-moves, repetition.
+#
+# Games aren't tied to a connection, so the two players of a game may use different connections. Moves are played with
+# game.Game, the same turn logic used by the pygame front end. Between requests each game's board only keeps the
+# position and its history (about 20 KB after 40 moves): cached moves and attack maps are dropped after every request.
+#
+# Usage:
+#     python server.py --port 8765                       Serve games until interrupted.
+#     python server.py --load-test --clients 200         Start a server, and play random games against it from 200
+#                                                        clients at once. Prints the latency of each move.
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from board import Board
+from game import Game
+import exceptions
+
+
+DEFAULT_PORT = 8765
+
+# Status for each way a game can end
+STALEMATE_STATUSES = {'No moves': 'stalemate', 'No progress': 'fifty-moves', 'Repeated moves': 'repetition'}
+
+# Percentiles reported by the load test
+PERCENTILES = 50, 90, 99, 99.9
+
+
+def get_status(game):
+    if isinstance(game.game_over, exceptions.CheckmateError):
+        return 'checkmate'
+    if isinstance(game.game_over, exceptions.StalemateError):
+        return STALEMATE_STATUSES[game.game_over.cause]
+    return 'check' if game.check_flag else 'playing'
+
+
+class GameServer:
+    def __init__(self):
+        # Game for each game ID
+        self.games = {}
+        self.next_id = 1
+        self.requests = 0
+
+    def get_game(self, game_id):
+        try:
+            return self.games[int(game_id)]
+        except (KeyError, ValueError):
+            raise ValueError("No such game: " + game_id)
+
+    def handle_request(self, line):
+        # Reply to one line of the protocol, without the line ending.
+        self.requests += 1
+        words = line.split()
+        if not words:
+            return 'error Empty request'
+        command, args = words[0].lower(), words[1:]
+        game = None
+        try:
+            if command == 'new':
+                game = Game(Board.from_fen(' '.join(args)) if args else Board())
+                game_id = self.next_id
+                self.next_id += 1
+                self.games[game_id] = game
+                return 'ok %d' % game_id
+            if command not in ('move', 'moves', 'fen', 'status', 'close') or not args:
+                return 'error Unknown request: ' + line.strip()
+            game = self.get_game(args[0])
+            if command == 'move':
+                if len(args) != 2:
+                    return 'error Usage: move GAME_ID MOVE'
+                game.play_move(args[1])
+                return 'ok ' + get_status(game)
+            if command == 'moves':
+                return ' '.join(['ok'] + [str(move) for move in game.board.get_legal_moves()])
+            if command == 'fen':
+                return 'ok ' + game.board.to_fen()
+            if command == 'status':
+                return 'ok ' + get_status(game)
+            del self.games[int(args[0])]
+            return 'ok'
+        except ValueError as e:
+            return 'error ' + str(e)
+        finally:
+            if game:
+                game.board.clear_caches()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = self.handle_request(line.decode('utf-8', 'replace'))
+                except Exception as e:
+                    # Keep the connection open: other games on it are unaffected.
+                    reply = 'error Internal error: %s' % e
+                writer.write((reply + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        # Start listening. Returns the asyncio server.
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+class Client:
+    # Connection to a GameServer, for testing.
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=DEFAULT_PORT):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, line):
+        # Send a request, and return the words of the reply after 'ok'. Raises ValueError for an error reply.
+        self.writer.write((line + '\n').encode())
+        await self.writer.drain()
+        reply = (await self.reader.readline()).decode().split()
+        if not reply or reply[0] != 'ok':
+            raise ValueError(' '.join(reply[1:]) or "Connection closed")
+        return reply[1:]
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def play_random_games(host, port, games, max_plies, latencies, seed):
+    # Play games of random moves, adding the seconds taken by each move request to latencies.
+    # Returns the number of moves played.
+    rng = random.Random(seed)
+    client = await Client.connect(host, port)
+    plies = 0
+    try:
+        for _ in range(games):
+            game_id = (await client.request('new'))[0]
+            status = 'playing'
+            for _ in range(max_plies):
+                if status not in ('playing', 'check'):
+                    break
+                moves = await client.request('moves ' + game_id)
+                start = time.perf_counter()
+                status = (await client.request('move %s %s' % (game_id, rng.choice(moves))))[0]
+                latencies.append(time.perf_counter() - start)
+                plies += 1
+            await client.request('close ' + game_id)
+    finally:
+        await client.close()
+    return plies
+
+
+def get_percentile(sorted_values, percentile):
+    # Nearest-rank percentile of a sorted list
+    index = max(0, min(len(sorted_values) - 1, int(round(percentile / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def load_test(host, port, clients, games, max_plies):
+    # Start a server, then play random games against it from many clients at once, and print the latency of the move
+    # requests. Each client plays its games one after another.
+    server = GameServer()
+    listener = await server.start(host, port)
+    port = listener.sockets[0].getsockname()[1]
+    latencies = []
+    start = time.perf_counter()
+    try:
+        plies = await asyncio.gather(*(play_random_games(host, port, games, max_plies, latencies, seed)
+                                       for seed in range(clients)))
+    finally:
+        listener.close()
+        await listener.wait_closed()
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    print("%d clients, %d games, %d moves, %d requests in %.2fs (%.0f moves/s, %.0f requests/s)" %
+          (clients, clients * games, sum(plies), server.requests, seconds, sum(plies) / seconds,
+           server.requests / seconds))
+    if latencies:
+        print("Move latency: " + ', '.join('p%g %.1f ms' % (percentile, 1000 * get_percentile(latencies, percentile))
+                                           for percentile in PERCENTILES) +
+              ', max %.1f ms' % (1000 * latencies[-1]))
+
+
+async def serve(host, port):
+    server = GameServer()
+    listener = await server.start(host, port)
+    print("Serving games on %s:%d" % listener.sockets[0].getsockname()[:2], file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Host many games of chess over TCP.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int,
+                        help="port to listen on (default: %d, or any free port for --load-test)" % DEFAULT_PORT)
+    parser.add_argument('--load-test', action='store_true',
+                        help="play random games against a new server, and print the move latency")
+    parser.add_argument('--clients', type=int, default=100, help="number of clients for --load-test (default: 100)")
+    parser.add_argument('--games', type=int, default=1, help="games played by each client (default: 1)")
+    parser.add_argument('--plies', type=int, default=100, help="most moves played in each game (default: 100)")
+    args = parser.parse_args(args)
+
+    try:
+        if args.load_test:
+            port = 0 if args.port is None else args.port
+            asyncio.run(load_test(args.host, port, args.clients, args.games, args.plies))
+        else:
+            asyncio.run(serve(args.host, DEFAULT_PORT if args.port is None else args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# Transposition table: a fixed-size cache of results for positions, keyed by Board.zobrist_key.
+#
+# The same position is often reached by different move orders. Storing what was found about it (legal moves,
+# evaluation, search depth and bound, best move) avoids working it out again.
+#
+# The table is a set of flat arrays with a fixed number of slots, so it never grows past its memory budget. Each key can
+# only be stored in the slots of one bucket, chosen by the low bits of the key. When the bucket is full an old entry is
+# replaced according to the replacement policy:
+#     'depth-preferred' -- 1 slot per bucket. Keep the old entry if it was searched deeper than the new one.
+#     'always-replace' -- 1 slot per bucket. Always keep the newest entry.
+#     'two-tier' -- 2 slots per bucket. The first slot holds the deepest entry seen, as for 'depth-preferred'. The
+#                   second holds the newest entry that didn't go in the first. This keeps valuable deep results while
+#                   still caching recent ones.
+
+from array import array
+from collections import namedtuple
+
+from board import Move
+
+
+# Bounds for stored scores. The true score is equal to, at least, or at most the stored score.
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+POLICIES = 'depth-preferred', 'always-replace', 'two-tier'
+
+# Approximate memory used by one slot: the fixed-size arrays (24 bytes), plus a typical stored legal move list
+# (2 bytes per move, in a bytes object).
+SLOT_SIZE = 128
+
+# Result of a successful probe. best_move is a board.Move or None. legal_moves is a list of board.Move or None.
+Entry = namedtuple('Entry', ['depth', 'score', 'bound', 'best_move', 'legal_moves'])
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16, policy='two-tier'):
+        if policy not in POLICIES:
+            raise ValueError("Replacement policy must be one of: " + ', '.join(POLICIES))
+        self.policy = policy
+        self.bucket_size = 2 if policy == 'two-tier' else 1
+
+        # Number of buckets is the largest power of 2 that fits in the budget, so the index is key & mask.
+        buckets = 1
+        while buckets * 2 * self.bucket_size * SLOT_SIZE <= size_mb * 1024 * 1024:
+            buckets *= 2
+        self.mask = buckets - 1
+        self.size = buckets * self.bucket_size
+
+        self.clear()
+
+    def clear(self):
+        size = self.size
+        self.keys = array('Q', bytes(8 * size))
+        # Depth of -1 marks an empty slot.
+        self.depths = array('b', [-1]) * size
+        self.scores = array('q', bytes(8 * size))
+        self.bounds = array('B', bytes(size))
+        # Encoded moves. See board.Move.encode. 0 => no move.
+        self.best_moves = array('H', bytes(2 * size))
+        # Encoded legal moves, packed into bytes. None => not stored.
+        self.legal_moves = [None] * size
+
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0  # Misses where the slot held a different position
+        self.stores = 0
+        self.overwrites = 0  # Stores which replaced a different position
+
+    def get_slot(self, key):
+        # Slot holding the key, or None.
+        first = (key & self.mask) * self.bucket_size
+        for slot in range(first, first + self.bucket_size):
+            if self.keys[slot] == key and self.depths[slot] >= 0:
+                return slot
+        return None
+
+    def probe(self, key):
+        # Entry for the position with this hash, or None.
+        slot = self.get_slot(key)
+        if slot is None:
+            self.misses += 1
+            first = (key & self.mask) * self.bucket_size
+            if any(self.depths[first + i] >= 0 for i in range(self.bucket_size)):
+                self.collisions += 1
+            return None
+        self.hits += 1
+
+        best_move = self.best_moves[slot]
+        legal_moves = self.legal_moves[slot]
+        if legal_moves is not None:
+            legal_moves = [Move.decode(code) for code in array('H', legal_moves)]
+        return Entry(self.depths[slot], self.scores[slot], self.bounds[slot],
+                     Move.decode(best_move) if best_move else None, legal_moves)
+
+    def store(self, key, depth, score=0, bound=EXACT, best_move=None, legal_moves=None):
+        # Store results for the position with this hash. depth is how many moves deep the score was searched
+        # (0 to 127). Storing a position again replaces its old entry.
+        slot = self.get_slot(key)
+        if slot is None:
+            slot = (key & self.mask) * self.bucket_size
+            if self.policy == 'depth-preferred' and self.depths[slot] > depth:
+                return
+            if self.policy == 'two-tier' and 0 <= self.depths[slot] <= depth:
+                # Move the old deepest entry down to the always-replace slot, replacing what was there.
+                if self.depths[slot + 1] >= 0:
+                    self.overwrites += 1
+                self.copy_slot(slot, slot + 1)
+            else:
+                if self.policy == 'two-tier' and self.depths[slot] > depth:
+                    slot += 1  # Keep the deeper entry. Use the always-replace slot.
+                if self.depths[slot] >= 0:
+                    self.overwrites += 1
+        self.stores += 1
+
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.scores[slot] = score
+        self.bounds[slot] = bound
+        self.best_moves[slot] = best_move.encode() if best_move else 0
+        if legal_moves is not None:
+            legal_moves = array('H', [move.encode() for move in legal_moves]).tobytes()
+        self.legal_moves[slot] = legal_moves
+
+    def copy_slot(self, source, target):
+        self.keys[target] = self.keys[source]
+        self.depths[target] = self.depths[source]
+        self.scores[target] = self.scores[source]
+        self.bounds[target] = self.bounds[source]
+        self.best_moves[target] = self.best_moves[source]
+        self.legal_moves[target] = self.legal_moves[source]
+
+    def get_stats(self):
+        probes = self.hits + self.misses
+        used = sum(1 for depth in self.depths if depth >= 0)
+        return {
+            'size': self.size,
+            'used': used,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / probes if probes else 0.0,
+            'collisions': self.collisions,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+        }
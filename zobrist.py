@@ -0,0 +1,37 @@
+# Random keys for Zobrist hashing of positions.
+#
+# The hash of a position is the XOR of one key for each piece on its square, plus keys for the player to move, the
+# castling rights and the file of a pawn which can be captured en-passant. Moving a piece only needs a few XORs to
+# update the hash. See Board.make_move.
+#
+# The keys are generated from a fixed seed, so hashes are the same in every process and can be stored.
+
+import random
+
+import pieces
+
+
+_random = random.Random(0x5EED)
+
+
+def get_key():
+    return _random.getrandbits(64)
+
+
+# PIECE_KEYS[piece_class][colour][square], where square = y * 8 + x
+PIECE_KEYS = {piece_class: tuple([get_key() for _ in range(64)] for _ in range(2)) for piece_class in
+              (pieces.Pawn, pieces.Knight, pieces.Bishop, pieces.Rook, pieces.Queen, pieces.King)}
+
+# Included when black is to move.
+BLACK_TO_MOVE_KEY = get_key()
+
+# CASTLING_KEYS[rights], where rights is a combination of the castling bits in board.py.
+_castling_keys = [get_key() for _ in range(4)]
+CASTLING_KEYS = [0] * 16
+for _rights in range(16):
+    for _i in range(4):
+        if _rights & (1 << _i):
+            CASTLING_KEYS[_rights] ^= _castling_keys[_i]
+
+# EN_PASSANT_KEYS[x] for the file of the square skipped by a pawn's double-move.
+EN_PASSANT_KEYS = [get_key() for _ in range(8)]